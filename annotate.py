@@ -1,59 +1,95 @@
 #!/usr/bin/env python3
 
 '''
-This script is used to replace Accession Numbers with Annotations in the column `Annotations`. The script can only be used on the formatted proteome files that have the extension *_formatted.txt.
+This script is used to replace Accession Numbers with Annotations in the column `Annotations`. The script can only be used on the formatted proteome files that have the extension *_formatted.txt (or *_formatted.parquet/*_formatted.feather, see table_io.py).
 
-USAGE: python annotate.py </path/annotations_file.txt> </path/input_foldername/>
+The annotations are read from an index file that is built next to the annotation file the first time it is used and rebuilt whenever the annotation file changes (see annotation_index.py). Lines of the annotation file without a tab are skipped and reported.
+
+All files of the folder can be annotated in parallel by giving the number of worker processes (default: 1).
+The annotated files can be written as tab-delimited text (tsv, default) or in one of the binary formats of table_io.py (parquet, feather).
+
+USAGE: python annotate.py </path/annotations_file.txt> </path/input_foldername/> [workers] [tsv|tsv.gz|tsv.zst|parquet|feather]
 '''
 
 import glob
 import os
 import sys
+import time
+
+from annotation_index import AnnotationIndex
+from batch import print_summary, run_per_file
+from instrumentation import timed
+from ingest import annotate_rows, table_rows, write_rows
+from table_io import FORMATS, read_table, strip_extension, table_format, write_table
+
+# Annotation index and output format used by the worker processes, set by _init_worker
+_index = None
+_output_format = 'tsv'
+
+# Function to annotate a single file (Replacing values in column 2) if annotations are not provided.
+# index is the AnnotationIndex of the annotation file with the SPO numbers and associated annotations.
+@timed('annotate_file', rows=lambda result: result['rows_out'], file=0)
+def annotate_file(filepath, index, output_format='tsv'):
+    start_time = time.perf_counter()
+
+    output_file_path = strip_extension(filepath)[:-len('_formatted')] + '_annotated' + FORMATS[output_format]
+
+    # Files in a binary format (or written to one) are annotated as a whole table
+    if output_format != 'tsv' or table_format(filepath) != 'tsv':
+        df = read_table(filepath)
+        accessions = df['Accession Number'].astype(str)
+        annotations = accessions.map(index.lookup(accessions.unique()))
+        unknown = int(annotations.isna().sum())
+        df['Annotation'] = annotations.fillna('Unknown')
+        output_file_path = write_table(df, output_file_path, output_format)
+
+        return {'file': os.path.basename(filepath), 'output': output_file_path, 'rows_in': len(df), 'rows_out': len(df),
+                'unknown': unknown, 'seconds': time.perf_counter() - start_time}
+
+    # Text files are annotated line by line (see ingest.py)
+    counts = {'rows_in': 0, 'rows_out': 0, 'unknown': 0}
+    with open(filepath, 'r') as input_file:
+        header = input_file.readline().strip().split('\t')
+        write_rows(output_file_path, header, annotate_rows(table_rows(input_file, counts), index, counts), counts)
+
+    return {'file': os.path.basename(filepath), 'output': output_file_path, 'rows_in': counts['rows_in'], 'rows_out': counts['rows_out'],
+            'unknown': counts['unknown'], 'seconds': time.perf_counter() - start_time}
 
-# Reading in the SPO numbers and associated annotations and saving them in the dictionary SPO_dict
-input_file = sys.argv[1]
-SPO_dict = {}
-
-with open(input_file, 'r') as file:
-    for line in file:
-        spo, annotation = line.strip().split('\t', 1)  # Split the line at the first tab character
-        SPO_dict[spo] = annotation
-
-# Function to annotate the files (Replacing values in column 2) if annotations are not provided
-def annotate(folder):
-    for filepath in glob.glob(os.path.join(folder, '*_formatted.txt')):
-        filename = os.path.basename(filepath)  # Get the filename
-        print(f"Processing file: {filename}")
-    
-        output_file_path = filepath.replace('_formatted.txt', '_annotated.txt')
-    
-        with open(filepath, 'r') as input_file, open(output_file_path, 'w') as output_file:
-            # Write the header line to the output file
-            header = input_file.readline().strip() + '\n'
-            output_file.write(header)
-        
-            # Process each line in the input file
-            for line in input_file:
-                # Split the line into columns
-                columns = line.strip().split('\t')
-                spo_id = columns[2]  # Extract the SPO ID from column 3
-            
-                # Look up the annotation in the dictionary
-                annotation = SPO_dict.get(spo_id, 'Unknown')
-                columns[1] = annotation
-            
-                # Join the columns back into a line and write to the output file
-                output_line = '\t'.join(columns) + '\n'
-                output_file.write(output_line)
-    
-        print(f"Annotated lines written to: {output_file_path}")
-
-
-if __name__ == "__main__": 
-    
-    if len(sys.argv) !=3: # If there is more than 2 argument to call this script, it will provide guidance on how to use it.
-        print("Usage: python annotate.py </path/annotations_file.txt> </path/input_foldername/>")
+def _init_worker(index, output_format):
+    global _index, _output_format
+    _index = index
+    _output_format = output_format
+
+def _annotate_worker(filepath):
+    return annotate_file(filepath, _index, _output_format)
+
+# Function to annotate all formatted files of a folder, on a pool of worker processes if workers > 1
+def annotate(folder, index, workers=1, output_format='tsv'):
+    filepaths = sorted(filepath for extension in FORMATS.values()
+                       for filepath in glob.glob(os.path.join(folder, '*_formatted' + extension)))
+    for filepath in filepaths:
+        print(f"Processing file: {os.path.basename(filepath)}")
+
+    results = run_per_file(_annotate_worker, filepaths, workers, initializer=_init_worker, initargs=(index, output_format))
+
+    for result in results:
+        print(f"Annotated lines written to: {result['output']}")
+    print_summary(results)
+
+    return results
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) not in (3, 4, 5): # If there are more than 4 arguments to call this script, it will provide guidance on how to use it.
+        print("Usage: python annotate.py </path/annotations_file.txt> </path/input_foldername/> [workers] [tsv|tsv.gz|tsv.zst|parquet|feather]")
         sys.exit(1)
-    
+
+    # The annotation file is only parsed if its index does not exist yet or is outdated
+    index = AnnotationIndex(sys.argv[1])
+    print(index.report())
+
     folder = sys.argv[2]
-    annotate(folder)
\ No newline at end of file
+    workers = int(sys.argv[3]) if len(sys.argv) >= 4 else 1
+    output_format = sys.argv[4] if len(sys.argv) == 5 else 'tsv'
+    annotate(folder, index, workers, output_format)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+'''
+This script contains the classifier that sorts proteins into categories by keywords in their annotations (e.g. proteases and peptidases in the xy plots).
+
+Every protein gets exactly one category. The categories are checked in priority order and the first category with a keyword in the annotation is used, so a "zinc metalloprotease" is a Metalloprotease and not also a Protease. Proteins without any keyword get the category Other (Non-Protease for the default categories). Keywords are matched case-insensitively anywhere in the annotation.
+
+All keywords are combined into one regular expression that is matched once per annotation, and the category of every annotation is remembered, so each annotation text is only classified once per process, no matter in how many comparisons (plots, lists) it appears.
+
+The categories can be given as a tab-delimited file, one category per line in priority order, with its keywords separated by commas:
+    Metalloprotease <tab> metalloprotease
+    Protease <tab> protease,proteinase
+Lines starting with # are ignored. Instead of a file, 'default' selects the default categories (proteases and peptidases).
+
+This script prints the number of proteins per category of a comparison or sample file.
+
+USAGE: python annotation_classes.py </path/input_file> [</path/categories_file.txt>]
+'''
+
+import functools
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+
+from table_io import read_header, read_table
+
+# Default categories in priority order: category, keywords
+DEFAULT_CATEGORIES = [
+    ('Metalloprotease', ['metalloprotease']),
+    ('Metallopeptidase', ['metallopeptidase']),
+    ('Protease', ['protease']),
+    ('Peptidase', ['peptidase']),
+]
+
+# Category of proteins without a keyword of the default categories
+DEFAULT_OTHER = 'Non-Protease'
+
+class AnnotationClassifier:
+    def __init__(self, categories=None, other=None):
+        if categories is None:
+            categories = DEFAULT_CATEGORIES
+            other = other or DEFAULT_OTHER
+        self.categories = [category for category, _ in categories]
+        self.other = other or 'Other'
+        if self.other in self.categories:
+            raise ValueError(f"{self.other} is used for proteins without a keyword and cannot be a category")
+
+        # One group per category; the lookahead tries every position of the annotation, so a keyword of a
+        # category with higher priority is found even if it lies inside a keyword of another category
+        groups = [f"(?P<c{i}>{'|'.join(re.escape(keyword) for keyword in keywords)})"
+                  for i, (_, keywords) in enumerate(categories) if keywords]
+        self._pattern = re.compile(f"(?=(?:{'|'.join(groups)}))", re.IGNORECASE) if groups else None
+        self._cache = {}
+
+    def __getstate__(self):
+        # The cache is not sent to worker processes, they fill their own
+        state = self.__dict__.copy()
+        state['_cache'] = {}
+        return state
+
+    @property
+    def names(self):
+        # All categories in priority order, followed by the category of unclassified proteins
+        return self.categories + [self.other]
+
+    def category(self, annotation):
+        # Position of the category of one annotation in names
+        if annotation in self._cache:
+            return self._cache[annotation]
+
+        best = len(self.categories)
+        if self._pattern is not None and isinstance(annotation, str):
+            for match in self._pattern.finditer(annotation):
+                best = min(best, next(int(name[1:]) for name, value in match.groupdict().items() if value is not None))
+        self._cache[annotation] = best
+        return best
+
+    def classify(self, annotations):
+        # Categories of all annotations as a pandas Categorical (in the order of names).
+        # Every distinct annotation is classified once.
+        annotations = pd.Series(annotations)
+        if isinstance(annotations.dtype, pd.CategoricalDtype):
+            codes, uniques = annotations.cat.codes.to_numpy(), annotations.cat.categories
+        else:
+            codes, uniques = pd.factorize(annotations.astype(object))
+        # Missing annotations (code -1) take the last entry, the unclassified category
+        unique_categories = np.array([self.category(annotation) for annotation in uniques] + [len(self.categories)], dtype=np.int64)
+        return pd.Categorical.from_codes(unique_categories[codes], categories=self.names)
+
+def read_categories(path):
+    # Categories (in priority order) and their keywords from a tab-delimited file
+    categories = []
+    with open(path, 'r') as file:
+        for line in file:
+            if not line.strip() or line.startswith('#'):
+                continue
+            category, _, keywords = line.rstrip('\r\n').partition('\t')
+            keywords = [keyword.strip() for keyword in keywords.split(',') if keyword.strip()]
+            if not keywords:
+                raise ValueError(f"Category {category} in {path} has no keywords (use: category <tab> keyword,keyword)")
+            categories.append((category.strip(), keywords))
+    return categories
+
+@functools.lru_cache(maxsize=None)
+def load_classifier(categories_file=None):
+    # Classifier of the default categories or of a categories file, shared by all scripts of a process
+    # so every annotation is only classified once; None or 'default' = the default categories
+    if categories_file in (None, 'default'):
+        return AnnotationClassifier()
+    return AnnotationClassifier(read_categories(categories_file))
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python annotation_classes.py </path/input_file> [</path/categories_file.txt>]")
+        sys.exit(1)
+
+    annotation = next(column for column in read_header(sys.argv[1]) if column.startswith('Annotation'))
+    annotations = read_table(sys.argv[1], columns=[annotation])[annotation]
+    classifier = load_classifier(sys.argv[2] if len(sys.argv) == 3 else None)
+
+    counts = pd.Series(classifier.classify(annotations)).value_counts(sort=False)
+    for category, count in counts.items():
+        print(f"{category}\t{count}")
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+'''
+This script contains the on-disk index of an annotation table (accession number <tab> annotation) used by annotate.py.
+
+The index is a SQLite database stored next to the annotation table (<annotations_file>.idx). It is built the first time the table is used and then opened read-only and memory-mapped, so later runs start immediately and do not hold the whole table in memory. The index is rebuilt automatically when the size or modification time of the annotation table changes.
+
+While building the index, lines without a tab are skipped and counted as malformed. If an accession number is listed more than once, the last annotation is used (as before) and the accession is counted once as duplicated.
+
+USAGE: python annotation_index.py </path/annotations_file.txt>
+'''
+
+import os
+import sqlite3
+import sys
+
+# Size of the memory map used to read the index
+MMAP_SIZE = 1024 ** 3
+
+# Maximum number of accession numbers per query in lookup
+QUERY_SIZE = 500
+
+# Version of the index; indexes of other versions are rebuilt
+INDEX_VERSION = 2
+
+class AnnotationIndex:
+    def __init__(self, annotations_file, index_file=None):
+        self.annotations_file = annotations_file
+        self.index_file = index_file or annotations_file + '.idx'
+        self.rebuilt = False
+        self._connection = None
+
+        source = os.stat(annotations_file)
+        self.stats = self._read_stats()
+        if (self.stats is None or self.stats.get('version') != INDEX_VERSION
+                or self.stats['size'] != source.st_size or self.stats['mtime_ns'] != source.st_mtime_ns):
+            self.stats = self._build(source)
+            self.rebuilt = True
+
+    def __getstate__(self):
+        # The database connection cannot be sent to worker processes, they open their own
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        return state
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(f'file:{self.index_file}?mode=ro', uri=True)
+            self._connection.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+        return self._connection
+
+    def _read_stats(self):
+        # Statistics stored in the index, or None if there is no (valid) index
+        if not os.path.exists(self.index_file):
+            return None
+        try:
+            connection = sqlite3.connect(f'file:{self.index_file}?mode=ro', uri=True)
+            stats = dict(connection.execute('SELECT key, value FROM meta'))
+            connection.close()
+        except sqlite3.DatabaseError:
+            return None
+        return stats
+
+    def _build(self, source):
+        # Build the index in a temporary file and move it in place when it is complete
+        temporary_file = f'{self.index_file}.{os.getpid()}.tmp'
+        if os.path.exists(temporary_file):
+            os.remove(temporary_file)
+
+        connection = sqlite3.connect(temporary_file)
+        connection.execute('PRAGMA journal_mode = OFF')
+        connection.execute('PRAGMA synchronous = OFF')
+        connection.execute('CREATE TABLE annotations (accession TEXT PRIMARY KEY, annotation TEXT) WITHOUT ROWID')
+        connection.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value INTEGER)')
+        # Accession numbers listed more than once, collected while inserting (not stored in the index)
+        connection.execute('CREATE TEMP TABLE duplicates (accession TEXT PRIMARY KEY) WITHOUT ROWID')
+        connection.execute('CREATE TEMP TRIGGER find_duplicates BEFORE INSERT ON annotations '
+                           'WHEN EXISTS (SELECT 1 FROM annotations WHERE accession = NEW.accession) '
+                           'BEGIN INSERT OR IGNORE INTO duplicates VALUES (NEW.accession); END')
+
+        lines = 0
+        malformed = 0
+
+        def records():
+            nonlocal lines, malformed
+            with open(self.annotations_file, 'r') as file:
+                for line in file:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    lines += 1
+                    if '\t' not in line:
+                        malformed += 1
+                        continue
+                    yield line.split('\t', 1)  # Split the line at the first tab character
+
+        connection.executemany('INSERT OR REPLACE INTO annotations VALUES (?, ?)', records())
+        accessions = connection.execute('SELECT COUNT(*) FROM annotations').fetchone()[0]
+        duplicated = connection.execute('SELECT COUNT(*) FROM duplicates').fetchone()[0]
+
+        stats = {
+            'version': INDEX_VERSION,
+            'size': source.st_size,
+            'mtime_ns': source.st_mtime_ns,
+            'lines': lines,
+            'accessions': accessions,
+            'malformed': malformed,
+            'duplicated': duplicated,
+        }
+        connection.executemany('INSERT INTO meta VALUES (?, ?)', stats.items())
+        connection.commit()
+        connection.close()
+
+        os.replace(temporary_file, self.index_file)
+        return stats
+
+    def get(self, accession, default=None):
+        row = self._connect().execute('SELECT annotation FROM annotations WHERE accession = ?', (accession,)).fetchone()
+        return default if row is None else row[0]
+
+    def lookup(self, accessions):
+        # Annotations of many accession numbers at once, as dictionary (accessions without annotation are left out)
+        accessions = list(accessions)
+        found = {}
+        for start in range(0, len(accessions), QUERY_SIZE):
+            chunk = accessions[start:start + QUERY_SIZE]
+            placeholders = ', '.join('?' * len(chunk))
+            found.update(self._connect().execute(
+                f'SELECT accession, annotation FROM annotations WHERE accession IN ({placeholders})', chunk))
+        return found
+
+    def report(self):
+        action = 'built' if self.rebuilt else 'loaded'
+        return (f"Annotation index {action}: {self.index_file} ({self.stats['accessions']} accessions, "
+                f"{self.stats['malformed']} malformed lines, {self.stats['duplicated']} duplicated accessions)")
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python annotation_index.py </path/annotations_file.txt>")
+        sys.exit(1)
+
+    print(AnnotationIndex(sys.argv[1]).report())
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+'''
+Helper functions to process all files of a folder in parallel. Used by format_proteomefile.py and annotate.py.
+
+The function applied to every file must be defined at the top level of a module (so it can be sent to the worker processes) and must return a dictionary with the statistics of that file, e.g.:
+    {'file': filename, 'rows_in': 1200, 'rows_out': 1200, 'unknown': 3, 'seconds': 0.05}
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+
+SUMMARY_COLUMNS = ['rows_in', 'rows_out', 'unknown', 'seconds']
+
+def run_per_file(function, filepaths, workers=1, initializer=None, initargs=()):
+    # Apply function to every file, on a pool of worker processes if workers > 1.
+    # The results are returned in the order of filepaths, independent of which worker finished first.
+    if workers == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        return [function(filepath) for filepath in filepaths]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+        return list(pool.map(function, filepaths))
+
+def print_summary(results):
+    # Print one line per file and the totals of all files
+    if not results:
+        print("No files processed.")
+        return
+
+    width = max(len('TOTAL'), *(len(result['file']) for result in results))
+    print('file'.ljust(width) + ''.join(f'\t{column}' for column in SUMMARY_COLUMNS))
+
+    totals = {'file': 'TOTAL'}
+    for result in results:
+        print(_summary_line(result, width))
+        for column in SUMMARY_COLUMNS:
+            if result.get(column) is not None:
+                totals[column] = totals.get(column, 0) + result[column]
+
+    print(_summary_line(totals, width))
+
+def _summary_line(result, width):
+    line = result['file'].ljust(width)
+    for column in SUMMARY_COLUMNS:
+        value = result.get(column)
+        if value is None:
+            line += '\t-'
+        elif column == 'seconds':
+            line += f'\t{value:.2f}'
+        else:
+            line += f'\t{value}'
+    return line
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+'''
+This script measures the performance of the pipeline on synthetic Scaffold exports, so that changes that make the pipeline slower can be caught.
+
+A synthetic campaign of one strain (SYN) in two media (LB, MB) and two growth phases (EXP, STAT) is written to a work folder: four exports in the 13-column layout of Scaffold (see format_proteomefile.py) and an annotation file. About 10% of the proteins change in abundance between the conditions and a fraction (missing_rate) of the proteins is missing from every sample. The stages of the pipeline are then run one after the other on these files:
+    format = format_proteomefile.py
+    annotate = annotate.py
+    statistics = statistics.normalization for all 4 comparisons
+    significant = significant_list.py for all comparisons
+    volcano = volcano_plot.py for all comparisons
+    xy = xy_plot.py for all comparisons
+
+Every stage runs in a fresh Python process, so its peak memory (peak RSS) can be measured on its own. For every stage the wall time, the peak RSS and the number of rows processed per second are reported. The plotting stages start the image export engine before the time is taken (see plot_batch.py).
+
+The results can be saved as baseline (JSON) and later runs can be compared with it: a stage that takes more than tolerance (default: 20%) longer, or uses that much more memory, than in the baseline is reported as regression and the script exits with status 1.
+
+--proteins = number(s) of proteins per export, e.g. 1000,10000,100000 (default: 10000)
+--replicates = number of replicates per sample (default: 3)
+--missing = fraction of the proteins missing from each sample (default: 0.1)
+--stages = stages to report (default: all); earlier stages are run too, since the later ones need their files
+--repeat = run every configuration this many times and keep the fastest run (default: 1)
+--workdir = folder for the synthetic files (default: a temporary folder that is deleted afterwards)
+--save-baseline = save the results to this file
+--baseline = compare the results with this file
+
+USAGE: python benchmark.py [--proteins 1000,10000] [--replicates 3] [--missing 0.1] [--stages format,annotate,statistics,significant,volcano,xy] [--repeat N] [--workdir </path/foldername/>] [--save-baseline baseline.json] [--baseline baseline.json] [--tolerance 0.2]
+'''
+
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import peak_rss_mb
+
+STAGES = ['format', 'annotate', 'statistics', 'significant', 'volcano', 'xy']
+
+STRAIN = 'SYN'
+CONDITIONS = [('LB', 'EXP'), ('LB', 'STAT'), ('MB', 'EXP'), ('MB', 'STAT')]
+
+# Annotations of the synthetic proteins; the proteases and peptidases are coloured in the xy plots
+ANNOTATIONS = ['hypothetical protein', 'ABC transporter', 'transcriptional regulator', 'dehydrogenase',
+               'zinc metalloprotease', 'serine protease', 'aminopeptidase', 'metallopeptidase']
+ANNOTATION_WEIGHTS = [0.55, 0.15, 0.1, 0.1, 0.025, 0.025, 0.025, 0.025]
+
+def synthetic_campaign(folder, proteins=10000, replicates=3, missing_rate=0.1, seed=0):
+    # Write the four exports and the annotation file of a synthetic campaign to folder.
+    # Returns the paths of the exports and of the annotation file.
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok=True)
+
+    accessions = np.array([f"{STRAIN}{i:06d}" for i in range(proteins)])
+    annotations = rng.choice(ANNOTATIONS, size=proteins, p=ANNOTATION_WEIGHTS)
+    abundance = rng.lognormal(mean=1.0, sigma=1.5, size=proteins)
+    changing = rng.random(proteins) < 0.1
+
+    annotation_file = os.path.join(folder, 'annotations.txt')
+    with open(annotation_file, 'w') as file:
+        file.writelines(f"{accession}\t{annotation} {accession}\n" for accession, annotation in zip(accessions, annotations))
+
+    exports = []
+    for medium, phase in CONDITIONS:
+        # Fold change of the changing proteins in this condition, then Poisson counts per replicate
+        effect = np.where(changing, 2.0 ** rng.normal(0, 1.5, size=proteins), 1.0)
+        counts = rng.poisson((abundance * effect)[:, None], size=(proteins, replicates))
+        control = rng.poisson(abundance * 0.1)
+
+        # Missing proteins are left out of the export, the other lines are in random order like in Scaffold
+        rows = rng.permutation(np.flatnonzero(rng.random(proteins) >= missing_rate))
+        export = pd.DataFrame({
+            '#': np.arange(1, len(rows) + 1),
+            'Visible?': 'TRUE',
+            'Starred?': 'FALSE',
+            f'Identified Proteins ({len(rows)})': accessions[rows],
+            'Accession Number': accessions[rows],
+            'Alternate ID': '',
+            'Molecular Weight': '42 kDa',
+            'Protein Grouping Ambiguity': '',
+            'Taxonomy': STRAIN,
+        })
+        for replicate in range(replicates):
+            export[f'R{replicate + 1}'] = counts[rows, replicate]
+        export['Control'] = control[rows]
+
+        filepath = os.path.join(folder, f"20240101_{STRAIN}_{medium}_{phase}.txt")
+        export.to_csv(filepath, sep='\t', index=False)
+        exports.append(filepath)
+
+    return exports, annotation_file
+
+def _count_rows(filepaths):
+    # Number of lines (without the header) of text files
+    rows = 0
+    for filepath in filepaths:
+        with open(filepath, 'rb') as file:
+            rows += sum(1 for _ in file) - 1
+    return rows
+
+# Modules of every stage, imported before the time is taken
+STAGE_MODULES = {
+    'format': ['format_proteomefile', 'ingest'],
+    'annotate': ['annotate', 'annotation_index'],
+    'statistics': ['statistics', 'run_comparisons'],
+    'significant': ['significant_list', 'run_comparisons'],
+    'volcano': ['volcano_plot', 'plot_batch', 'run_comparisons'],
+    'xy': ['xy_plot', 'plot_batch', 'run_comparisons'],
+}
+
+def _comparisons(folder):
+    # Comparison files written by the statistics stage
+    from run_comparisons import comparison_pairs, find_samples
+    from statistics import comparison_conditions
+    return [os.path.join(folder, comparison_conditions(file_1, file_2)[2]) for file_1, file_2 in comparison_pairs(find_samples(folder))]
+
+def run_stage(stage, folder, annotation_file):
+    # Run one stage on the files of folder and measure it. Called in a fresh process, so only
+    # the modules of this stage are loaded; they are imported before the time is taken.
+    if stage not in STAGES:
+        raise ValueError(f"Unknown stage: {stage} (use one of {', '.join(STAGES)})")
+    for module in STAGE_MODULES[stage]:
+        importlib.import_module(module)
+
+    comparisons = _comparisons(folder)
+    plot_folder = os.path.join(folder, 'figures')
+    if stage in ('volcano', 'xy'):
+        from plot_batch import start_image_engine
+        os.makedirs(plot_folder, exist_ok=True)
+        start_image_engine()
+
+    start_time = time.perf_counter()
+
+    if stage == 'format':
+        from format_proteomefile import format_proteomefile
+        from ingest import find_exports
+        rows = sum(format_proteomefile(filepath)['rows_in'] for filepath in find_exports(folder))
+    elif stage == 'annotate':
+        from annotate import annotate_file
+        from annotation_index import AnnotationIndex
+        index = AnnotationIndex(annotation_file)
+        formatted = sorted(os.path.join(folder, name) for name in os.listdir(folder) if name.endswith('_formatted.txt'))
+        rows = sum(annotate_file(filepath, index)['rows_in'] for filepath in formatted)
+    elif stage == 'statistics':
+        from run_comparisons import comparison_pairs, find_samples
+        from statistics import normalization
+        rows = _count_rows([normalization(file_1, file_2) for file_1, file_2 in comparison_pairs(find_samples(folder))])
+    elif stage == 'significant':
+        from significant_list import significant_list_file
+        for filepath in comparisons:
+            significant_list_file(filepath, folder)
+        rows = _count_rows(comparisons)
+    elif stage == 'volcano':
+        from volcano_plot import volcano_plot_file
+        for filepath in comparisons:
+            volcano_plot_file(filepath, plot_folder, auto_open=False)
+        rows = _count_rows(comparisons)
+    elif stage == 'xy':
+        from xy_plot import xy_plot_file
+        for filepath in comparisons:
+            xy_plot_file(filepath, plot_folder, auto_open=False)
+        rows = _count_rows(comparisons)
+
+    seconds = time.perf_counter() - start_time
+    return {'stage': stage, 'seconds': seconds, 'rows': rows, 'rows_per_second': rows / seconds if seconds > 0 else None,
+            'peak_rss_mb': peak_rss_mb()}
+
+def _silent_run_stage(stage, folder, annotation_file):
+    # The scripts print a line per file; keep the benchmark output readable
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        return run_stage(stage, folder, annotation_file)
+
+def run_benchmark(proteins=10000, replicates=3, missing_rate=0.1, stages=tuple(STAGES), workdir=None, seed=0):
+    # Generate a synthetic campaign and run all stages up to the last one in stages.
+    # Returns the results of the stages in stages.
+    last = max(STAGES.index(stage) for stage in stages)
+    folder = tempfile.mkdtemp(prefix='benchmark_') if workdir is None else os.path.join(workdir, f"proteins_{proteins}")
+    if os.path.exists(folder):
+        shutil.rmtree(folder)
+
+    try:
+        _, annotation_file = synthetic_campaign(folder, proteins, replicates, missing_rate, seed)
+
+        # Every stage runs in its own new process (spawn, not fork, so the memory of this process is not counted)
+        results = []
+        context = multiprocessing.get_context('spawn')
+        for stage in STAGES[:last + 1]:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                result = pool.submit(_silent_run_stage, stage, folder, annotation_file).result()
+            if stage in stages:
+                result.update({'proteins': proteins, 'replicates': replicates, 'missing_rate': missing_rate})
+                results.append(result)
+        return results
+    finally:
+        if workdir is None:
+            shutil.rmtree(folder, ignore_errors=True)
+
+def _key(result):
+    return (result['proteins'], result['replicates'], result['missing_rate'], result['stage'])
+
+def compare_baseline(results, baseline, tolerance=0.2):
+    # Stages that are more than tolerance slower or use more than tolerance more memory than in the baseline
+    baseline = {_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        reference = baseline.get(_key(result))
+        if reference is None:
+            continue
+        for measure in ('seconds', 'peak_rss_mb'):
+            if result[measure] is not None and reference[measure] and result[measure] > reference[measure] * (1 + tolerance):
+                regressions.append(f"{result['stage']} ({result['proteins']} proteins): {measure} "
+                                   f"{reference[measure]:.2f} -> {result[measure]:.2f} (+{result[measure] / reference[measure] - 1:.0%})")
+    return regressions
+
+def print_results(results):
+    print('proteins\tstage\tseconds\trows/s\tpeak_rss_mb')
+    for result in results:
+        rows_per_second = '-' if result['rows_per_second'] is None else f"{result['rows_per_second']:.0f}"
+        peak_rss = '-' if result['peak_rss_mb'] is None else f"{result['peak_rss_mb']:.0f}"
+        print(f"{result['proteins']}\t{result['stage']}\t{result['seconds']:.3f}\t{rows_per_second}\t{peak_rss}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline on synthetic Scaffold exports.')
+    parser.add_argument('--proteins', default='10000', help='number(s) of proteins per export, e.g. 1000,10000,100000 (default: 10000)')
+    parser.add_argument('--replicates', type=int, default=3, help='number of replicates per sample (default: 3)')
+    parser.add_argument('--missing', type=float, default=0.1, help='fraction of the proteins missing from each sample (default: 0.1)')
+    parser.add_argument('--stages', default=','.join(STAGES), help='stages to report (default: all)')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per configuration, the fastest is kept (default: 1)')
+    parser.add_argument('--workdir', help='folder for the synthetic files (default: temporary folder)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data (default: 0)')
+    parser.add_argument('--save-baseline', help='save the results to this JSON file')
+    parser.add_argument('--baseline', help='compare the results with this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown compared to the baseline (default: 0.2 = 20%%)')
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(',')]
+    for stage in stages:
+        if stage not in STAGES:
+            parser.error(f"unknown stage: {stage} (use {', '.join(STAGES)})")
+    if args.replicates < 2:
+        parser.error("the t-test needs at least 2 replicates per sample")
+
+    results = []
+    for proteins in [int(value) for value in args.proteins.split(',')]:
+        runs = [run_benchmark(proteins, args.replicates, args.missing, stages, args.workdir, args.seed) for _ in range(args.repeat)]
+        # Keep the fastest run of every stage
+        for stage_runs in zip(*runs):
+            results.append(min(stage_runs, key=lambda result: result['seconds']))
+
+    print_results(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            json.dump(results, file, indent=1)
+        print(f"Baseline written to: {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            regressions = compare_baseline(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions compared to: {args.baseline}")
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+'''
+This script runs all comparisons of a campaign (a folder of samples, see run_comparisons.py) from one aligned protein x replicate matrix instead of comparing the files pair by pair.
+
+statistics.py merges the two files of every comparison on "Accession Number" and normalizes the spectral counts with the average column sum of just these two samples, so the same sample gets different normalized values in every comparison it takes part in. Here all samples are aligned once on the sorted accession numbers of the whole campaign and normalized once:
+    normalized count = count / column sum of the replicate * average column sum of all replicates of the campaign
+The normalized values of a sample are therefore the same in all comparisons. Every comparison is then computed by slicing the rows and columns of the two samples out of the matrix. The log2 fold changes and p-values are the same as with statistics.py (the normalization factor cancels out in both), only the normalized counts, averages and standard deviations are scaled differently.
+
+The comparison files have the same columns and rows (the proteins found in either sample, sorted by accession number) as the ones written by statistics.py, so all later steps work unchanged.
+Every sample must list each accession number only once.
+Besides the q-values of every comparison, the p-values of all comparisons are corrected together (Campaign_BH_Q_Value, Campaign_Storey_Q_Value, see multiple_testing.py).
+
+With permutations, a permutation test with at most this many label swaps is used instead of the t-test (see permutation.py). The swaps of every comparison are spread over all CPUs and the estimated time is printed first.
+
+USAGE: python campaign.py </path/input_foldername/> [tsv|tsv.gz|tsv.zst|parquet|feather] [permutations]
+'''
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import timed
+from multiple_testing import correct_campaign, qvalue_columns
+from permutation import PermutationTest, print_estimate
+from run_comparisons import comparison_pairs, find_samples
+from statistics import batch_ttest, comparison_conditions, read_sample, suffixed_columns
+from table_io import AnnotationDictionary, replicate_columns, write_table
+
+class Campaign:
+    # All samples of a campaign aligned on the sorted accession numbers of the whole campaign
+
+    @timed('campaign_matrix')
+    def __init__(self, files):
+        self.files = [os.path.abspath(file) for file in files]
+        # The annotations of all samples are stored once, the samples only keep their codes
+        self.annotations = AnnotationDictionary()
+        samples = [read_sample(file, self.annotations) for file in self.files]
+
+        sample_accessions = []
+        for file, df in zip(self.files, samples):
+            accessions = df['Accession Number'].astype(str).to_numpy()
+            if len(np.unique(accessions)) != len(accessions):
+                raise ValueError(f"{os.path.basename(file)} lists some accession numbers more than once")
+            sample_accessions.append(accessions)
+
+        self.accessions = np.unique(np.concatenate(sample_accessions)) if samples else np.array([], dtype=str)
+
+        # The replicates of sample s are the columns replicates[s] of the matrix (any number per sample)
+        replicates = [replicate_columns(df.columns) for df in samples]
+        bounds = np.cumsum([0] + [len(columns) for columns in replicates])
+        self.replicates = [slice(start, end) for start, end in zip(bounds[:-1], bounds[1:])]
+
+        # present[protein, sample] and counts[protein, replicate] (0 where missing)
+        self.present = np.zeros((len(self.accessions), len(samples)), dtype=bool)
+        counts = np.zeros((len(self.accessions), bounds[-1]))
+        self._columns = []
+        for s, (df, accessions) in enumerate(zip(samples, sample_accessions)):
+            rows = np.searchsorted(self.accessions, accessions)
+            self.present[rows, s] = True
+            counts[rows, self.replicates[s]] = np.nan_to_num(df[replicates[s]].to_numpy(dtype=float))
+
+            # The other columns of the sample, aligned on the accession numbers of the campaign
+            aligned = df.set_index(df['Accession Number'].astype(str)).reindex(self.accessions)
+            aligned['Accession Number'] = self.accessions
+            self._columns.append((aligned.reset_index(drop=True), df.dtypes))
+
+        # Normalize all replicates once with the average column sum of the campaign
+        self.column_sums = counts.sum(axis=0)
+        self.scale = self.column_sums.mean() if len(self.column_sums) else 0.0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.normalized = np.nan_to_num(counts / self.column_sums * self.scale)
+
+    def __len__(self):
+        return len(self.files)
+
+    def _sample(self, file):
+        path = os.path.abspath(file)
+        if path not in self.files:
+            raise ValueError(f"{os.path.basename(file)} is not part of the campaign")
+        return self.files.index(path)
+
+    def _part(self, s, rows, suffix, suffixed):
+        # Columns of sample s for the selected rows, as they look after the outer merge of statistics.py
+        aligned, dtypes = self._columns[s]
+        part = aligned.loc[rows].reset_index(drop=True)
+        complete = self.present[rows, s].all()
+
+        for column in part.columns:
+            if column.startswith('Annotation'):
+                part[column] = part[column].fillna('Unknown')
+            elif column != 'Accession Number':
+                part[column] = part[column].fillna(0)
+                # Columns without missing rows keep their type, like in the merge
+                if complete:
+                    part[column] = part[column].astype(dtypes[column])
+
+        part.columns = [column + suffix if column in suffixed else column for column in part.columns]
+        normalized = self.normalized[rows, self.replicates[s]]
+        for replicate in range(normalized.shape[1]):
+            part[f'norms_{replicate + 1}_{suffix}'] = normalized[:, replicate]
+        return part, normalized
+
+    @timed('campaign_comparison', rows=len)
+    def comparison(self, file_1, file_2, permutation_test=None):
+        # Comparison of two samples of the campaign, in the layout of statistics.compare_samples.
+        # The p-values are from the t-test, or from the permutation test if one is given.
+        conditions = comparison_conditions(file_1, file_2)
+        if conditions is None:
+            raise ValueError(f"{os.path.basename(file_1)} and {os.path.basename(file_2)} must share the strain and either the medium or the growth phase")
+        suf_1, suf_2, _ = conditions
+        s1 = self._sample(file_1)
+        s2 = self._sample(file_2)
+
+        rows = self.present[:, s1] | self.present[:, s2]
+        suffixed = suffixed_columns(self._columns[s1][0].columns, self._columns[s2][0].columns)
+        part_1, normalized_1 = self._part(s1, rows, suf_1, suffixed)
+        part_2, normalized_2 = self._part(s2, rows, suf_2, suffixed)
+        combined_df = pd.concat([part_1, part_2.drop(columns='Accession Number')], axis=1)
+
+        # Row-wise averages and standard deviations of the normalized counts
+        average_1 = normalized_1.mean(axis=1)
+        average_2 = normalized_2.mean(axis=1)
+        combined_df[f'Row_Average_{suf_1}'] = average_1
+        combined_df[f'STD_{suf_1}'] = normalized_1.std(axis=1, ddof=1)
+        combined_df[f'Row_Average_{suf_2}'] = average_2
+        combined_df[f'STD_{suf_2}'] = normalized_2.std(axis=1, ddof=1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log2_fold_change = np.log2(average_1 / average_2)
+            test = batch_ttest if permutation_test is None else permutation_test.ttest
+            transformed_pvalues = -np.log10(test(normalized_1, normalized_2)[1])
+
+        combined_df['Log2_Fold_Change'] = np.where(np.isnan(log2_fold_change), 0, log2_fold_change)
+        combined_df['Transformed_P_Value'] = transformed_pvalues
+        for column, qvalues in qvalue_columns(transformed_pvalues).items():
+            combined_df[column] = qvalues
+        return combined_df
+
+def estimate_permutations(campaign, pairs, permutation_test):
+    # Print the estimated time of the permutation tests of all pairs
+    comparisons = []
+    for file_1, file_2 in pairs:
+        s1 = campaign._sample(file_1)
+        s2 = campaign._sample(file_2)
+        rows = np.count_nonzero(campaign.present[:, s1] | campaign.present[:, s2])
+        comparisons.append((rows, campaign.replicates[s1].stop - campaign.replicates[s1].start, campaign.replicates[s2].stop - campaign.replicates[s2].start))
+    return print_estimate(permutation_test, comparisons, permutation_test.workers)
+
+def run_campaign(folder, output_format='tsv', permutation_test=None, float_precision=None):
+    # Write all comparisons of the samples in folder, normalized over the whole campaign, with the
+    # q-values corrected over all comparisons. Returns the paths of the comparison files.
+    # float_precision = significant digits of the numbers in text outputs (default: full precision)
+    files = find_samples(folder)
+    pairs = comparison_pairs(files)
+    print(f"Found {len(files)} samples and {len(pairs)} comparisons in: {folder}")
+
+    campaign = Campaign(sorted({filepath for pair in pairs for filepath in pair}))
+    if permutation_test is not None:
+        estimate_permutations(campaign, pairs, permutation_test)
+
+    output_files = []
+    for file_1, file_2 in pairs:
+        output_name = comparison_conditions(file_1, file_2)[2]
+        output_filename = write_table(campaign.comparison(file_1, file_2, permutation_test), os.path.join(os.path.dirname(file_1), output_name),
+                                      output_format, float_precision)
+        print(f"Log2 fold change and p-values added. Data written to: {output_filename}")
+        output_files.append(output_filename)
+
+    correct_campaign(output_files)
+    return output_files
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3, 4):
+        print("Usage: python campaign.py </path/input_foldername/> [tsv|tsv.gz|tsv.zst|parquet|feather] [permutations]")
+        sys.exit(1)
+
+    output_format = sys.argv[2] if len(sys.argv) >= 3 else 'tsv'
+    permutation_test = PermutationTest(int(sys.argv[3]), workers=os.cpu_count()) if len(sys.argv) == 4 else None
+    run_campaign(sys.argv[1], output_format, permutation_test)
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+
+'''
+This script runs a local server for interactive use: the samples of a campaign (a folder of *_formatted / *_annotated files, see run_comparisons.py) are read once and kept in memory, and comparisons, lists of significant proteins and figures are returned as JSON over HTTP. Running statistics.py and volcano_plot.py again for every pair pays the start-up and the parsing of the files every time; here a repeated request is answered from memory in a few milliseconds.
+
+Samples that change on disk are read again (see statistics.SampleStore). Results are cached in memory; when they take up more than cache_bytes, the least recently used ones are dropped. Requests are computed in parallel (one thread per connection); a request that is already being computed by another connection waits for that result instead of computing it again.
+The server only listens on localhost (127.0.0.1) unless another host is given.
+
+Requests (GET; a and b are sample names as listed by /samples, e.g. 20240101_SPO_LB_EXP):
+    /samples                                                    samples of the campaign and the pairs that can be compared
+    /compare?a=&b=                                              accession numbers, annotations, log2 fold changes, -log10 p-values and q-values of all proteins
+    /significant?a=&b=[&log2fc=0.5][&pvalue=1.3][&fdr=][&method=bh|storey]   significantly over- and underexpressed proteins (see significant_list.py)
+    /volcano?a=&b=[&fdr=][&method=bh|storey]                    volcano plot as plotly figure JSON
+    /xy?a=&b=[&dense=auto|dense|full]                           xy plot as plotly figure JSON
+    /status                                                     number of samples, cached results, cache hits and misses
+Two samples can be compared if they share the strain and either the medium or the growth phase (see statistics.py). The order of a and b does not matter: the comparison is the same as the one written by run_comparisons.py. Numbers that are not finite (e.g. the log2 fold change of a protein found in only one sample) are returned as null. Errors are returned with status 400 or 404 and a JSON object {"error": ...}.
+
+cache_bytes = maximum memory used for the cached results (default: 1 GB; the samples are kept separately, see statistics.SampleStore)
+permutations, seed = use a permutation test with at most this many label swaps instead of the t-test (see permutation.py)
+categories = categories file of the proteins (see annotation_classes.py), or default: added to the significant lists, used for the xy plots and shown in the volcano plots
+
+USAGE: python comparison_server.py </path/input_foldername/> [--host 127.0.0.1] [--port 8765] [--cache-mb 1024] [--permutations N] [--seed 0] [--categories </path/categories_file.txt>|default]
+'''
+
+import argparse
+import json
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+import statistics
+from annotation_classes import load_classifier
+from multiple_testing import comparison_qvalues
+from permutation import PermutationTest
+from run_comparisons import comparison_pairs, find_samples
+from significant_list import classify
+from table_io import comparison_columns, strip_extension
+
+def sample_name(filepath):
+    # Name of a sample: the filename without the extension and the _formatted / _annotated suffix
+    name = strip_extension(os.path.basename(filepath))
+    for suffix in ('_formatted', '_annotated'):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+def json_values(values):
+    # Values of a column as a JSON list (numbers that are not finite become null)
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        return [float(value) if np.isfinite(value) else None for value in values]
+    return [None if value is None or value != value else str(value) for value in values.astype(object)]
+
+def result_bytes(result):
+    # Memory used by a cached result: a comparison (title, dataframe) or JSON text
+    if isinstance(result, str):
+        return len(result)
+    title, df = result
+    return len(title) + int(df.memory_usage(deep=True).sum())
+
+class ComparisonServer:
+    # Samples of a campaign and the cached results of the requests, independent of HTTP.
+    # The locks are only held to look up and store samples and results, the results are computed in parallel.
+
+    def __init__(self, folder, cache_bytes=1024 ** 3, permutation_test=None, categories=None):
+        self.folder = folder
+        self.cache_bytes = cache_bytes
+        self.nbytes = 0
+        self.permutation_test = permutation_test
+        self.categories = categories
+        self.samples = {sample_name(filepath): filepath for filepath in find_samples(folder)}
+        self.pairs = comparison_pairs(sorted(self.samples.values()))
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        # Results being computed: key -> Future, so the same result is only computed once
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._store_lock = threading.Lock()
+
+        # Read all samples once
+        self.store = statistics.SampleStore()
+        for filepath in self.samples.values():
+            self.store.get(filepath)
+
+    def _cached(self, key, compute):
+        # Result of compute, cached under key (the least recently used results are dropped when the cache is full).
+        # compute runs without holding the lock; other requests for the same key wait for its result.
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return self._results[key][0]
+
+            pending = self._pending.get(key)
+            owner = pending is None
+            if owner:
+                self.misses += 1
+                pending = self._pending[key] = Future()
+            else:
+                self.hits += 1
+
+        if not owner:
+            return pending.result()
+
+        try:
+            result = compute()
+        except BaseException as error:
+            with self._lock:
+                del self._pending[key]
+            pending.set_exception(error)
+            raise
+
+        nbytes = result_bytes(result)
+        with self._lock:
+            del self._pending[key]
+            # Results larger than the whole cache are returned, but not kept
+            if nbytes <= self.cache_bytes:
+                self._results[key] = (result, nbytes)
+                self.nbytes += nbytes
+                while self.nbytes > self.cache_bytes:
+                    self.nbytes -= self._results.popitem(last=False)[1][1]
+        pending.set_result(result)
+        return result
+
+    def _sample(self, filepath):
+        # Sample from the store (shared by all threads)
+        with self._store_lock:
+            return self.store.get(filepath)
+
+    def _pair(self, a, b):
+        # Files of two samples in the order of run_comparisons.py, with their modification times (part of the cache keys)
+        for name in (a, b):
+            if name not in self.samples:
+                raise ValueError(f"Unknown sample: {name} (see /samples)")
+        file_1, file_2 = sorted((self.samples[a], self.samples[b]))
+        if statistics.comparison_conditions(file_1, file_2) is None:
+            raise ValueError(f"{a} and {b} must share the strain and either the medium or the growth phase")
+        return file_1, file_2, os.stat(file_1).st_mtime_ns, os.stat(file_2).st_mtime_ns
+
+    def comparison(self, a, b):
+        # Comparison table of two samples, as written by statistics.py
+        pair = self._pair(a, b)
+
+        def compute():
+            file_1, file_2 = pair[:2]
+            suf_1, suf_2, output_name = statistics.comparison_conditions(file_1, file_2)
+            df = statistics.compare_samples(self._sample(file_1), self._sample(file_2), suf_1, suf_2, self.permutation_test)
+            return strip_extension(output_name), df
+
+        return self._cached(('comparison',) + pair, compute)
+
+    def protein_categories(self, df):
+        columns = comparison_columns(df)
+        return load_classifier(self.categories).classify(df[columns['annotation']]) if self.categories is not None else None
+
+    def samples_json(self):
+        return {
+            'folder': os.path.abspath(self.folder),
+            'samples': sorted(self.samples),
+            'pairs': [[sample_name(file_1), sample_name(file_2)] for file_1, file_2 in self.pairs],
+        }
+
+    def compare_json(self, a, b):
+        # The results of the requests are cached as JSON text, so a repeated request is not encoded again
+        def compute():
+            title, df = self.comparison(a, b)
+            columns = comparison_columns(df)
+            return json.dumps({
+                'title': title,
+                'accession': json_values(df[columns['accession']]),
+                'annotation': json_values(df[columns['annotation']]),
+                'log2_fold_change': json_values(df[columns['log2_fold_change']]),
+                'transformed_pvalue': json_values(df[columns['transformed_pvalue']]),
+                'bh_qvalue': json_values(df['BH_Q_Value']),
+                'storey_qvalue': json_values(df['Storey_Q_Value']),
+            })
+
+        return self._cached(('compare',) + self._pair(a, b), compute)
+
+    def significant_json(self, a, b, log2fc_threshold=0.5, pvalue_threshold=1.3, fdr=None, method='bh'):
+        def compute():
+            title, df = self.comparison(a, b)
+            columns = comparison_columns(df)
+            qvalues = comparison_qvalues(df, method) if fdr is not None else None
+            overexpressed, underexpressed = classify(df[columns['log2_fold_change']], df[columns['transformed_pvalue']],
+                                                     log2fc_threshold, pvalue_threshold, fdr, qvalues)
+            categories = self.protein_categories(df)
+
+            def proteins(mask):
+                rows = np.flatnonzero(mask)
+                listed = {
+                    'accession': json_values(df[columns['accession']].to_numpy()[rows]),
+                    'annotation': json_values(np.asarray(df[columns['annotation']], dtype=object)[rows]),
+                }
+                if categories is not None:
+                    listed['category'] = json_values(np.asarray(categories, dtype=object)[rows])
+                return listed
+
+            return json.dumps({'title': title, 'overexpressed': proteins(overexpressed), 'underexpressed': proteins(underexpressed)})
+
+        return self._cached(('significant', log2fc_threshold, pvalue_threshold, fdr, method) + self._pair(a, b), compute)
+
+    def volcano_json(self, a, b, fdr=None, method='bh'):
+        def compute():
+            from volcano_plot import volcano_figure
+
+            title, df = self.comparison(a, b)
+            columns = comparison_columns(df)
+            qvalues = comparison_qvalues(df, method) if fdr is not None else None
+            categories = self.protein_categories(df)
+            fig = volcano_figure(title, df[columns['log2_fold_change']], df[columns['transformed_pvalue']], df[columns['annotation']],
+                                 fdr=fdr, qvalues=qvalues, categories=np.asarray(categories, dtype=object) if categories is not None else None)
+            return fig.to_json()
+
+        return self._cached(('volcano', fdr, method) + self._pair(a, b), compute)
+
+    def xy_json(self, a, b, dense='auto'):
+        def compute():
+            from xy_plot import DENSE_MODES, xy_figure
+
+            title, df = self.comparison(a, b)
+            columns = comparison_columns(df)
+            fig = xy_figure(df[columns['average_1']], df[columns['average_2']], df[columns['annotation']], df[columns['std_1']], df[columns['std_2']],
+                            title, dense=DENSE_MODES[dense], classifier=load_classifier(self.categories))[0]
+            return fig.to_json()
+
+        return self._cached(('xy', dense) + self._pair(a, b), compute)
+
+    def status_json(self):
+        return {'samples': len(self.samples), 'cached': len(self._results), 'cache_bytes': self.nbytes, 'max_cache_bytes': self.cache_bytes,
+                'hits': self.hits, 'misses': self.misses, 'sample_bytes': self.store.nbytes}
+
+class RequestHandler(BaseHTTPRequestHandler):
+    # Answers the GET requests listed above with the ComparisonServer of the HTTP server
+    def do_GET(self):
+        start_time = time.perf_counter()
+        url = urlparse(self.path)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        comparisons = self.server.comparisons
+
+        def number(name, default=None):
+            return float(query[name]) if query.get(name) not in (None, '') else default
+
+        try:
+            if url.path == '/samples':
+                body = comparisons.samples_json()
+            elif url.path == '/status':
+                body = comparisons.status_json()
+            elif url.path == '/compare':
+                body = comparisons.compare_json(query['a'], query['b'])
+            elif url.path == '/significant':
+                body = comparisons.significant_json(query['a'], query['b'], number('log2fc', 0.5), number('pvalue', 1.3),
+                                                    number('fdr'), query.get('method', 'bh'))
+            elif url.path == '/volcano':
+                body = comparisons.volcano_json(query['a'], query['b'], number('fdr'), query.get('method', 'bh'))
+            elif url.path == '/xy':
+                dense = query.get('dense', 'auto')
+                if dense not in ('auto', 'dense', 'full'):
+                    raise ValueError(f"Unknown dense mode: {dense} (use auto, dense or full)")
+                body = comparisons.xy_json(query['a'], query['b'], dense)
+            else:
+                self.send_json(404, {'error': f"Unknown request: {url.path}"})
+                return
+        except KeyError as error:
+            self.send_json(400, {'error': f"Missing parameter: {error.args[0]}"})
+            return
+        except ValueError as error:
+            self.send_json(400, {'error': str(error)})
+            return
+        except Exception as error:
+            # Any other error (e.g. a file that cannot be read) is logged and returned, the server keeps running
+            self.log_error('%s failed: %r', self.path, error)
+            traceback.print_exc()
+            self.send_json(500, {'error': f"{type(error).__name__}: {error}"})
+            return
+
+        self.send_json(200, body, time.perf_counter() - start_time)
+
+    def send_json(self, status, body, seconds=None):
+        data = (body if isinstance(body, str) else json.dumps(body)).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if seconds is not None:
+            self.send_header('Server-Timing', f'compute;dur={seconds * 1000:.1f}')
+        self.end_headers()
+        self.wfile.write(data)
+
+def serve(folder, host='127.0.0.1', port=8765, cache_bytes=1024 ** 3, permutation_test=None, categories=None):
+    start_time = time.perf_counter()
+    comparisons = ComparisonServer(folder, cache_bytes, permutation_test, categories)
+    print(f"Read {len(comparisons.samples)} samples ({len(comparisons.pairs)} comparisons) in {time.perf_counter() - start_time:.1f} s from: {folder}")
+
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.comparisons = comparisons
+    print(f"Serving on http://{host}:{server.server_port}/ (stop with Ctrl+C)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve the comparisons and figures of a folder of samples over a local HTTP/JSON API.')
+    parser.add_argument('folder', help='folder with the samples (*_formatted / *_annotated)')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1, only this computer)')
+    parser.add_argument('--port', type=int, default=8765, help='port (default: 8765)')
+    parser.add_argument('--cache-mb', type=int, default=1024, help='maximum memory in MB used for the cached results (default: 1024)')
+    parser.add_argument('--permutations', type=int, help='permutation test with at most this many label swaps instead of the t-test')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the permutation test (default: 0)')
+    parser.add_argument('--categories', help="categories file of the proteins (see annotation_classes.py), or default")
+    args = parser.parse_args()
+
+    permutation_test = PermutationTest(args.permutations, args.seed) if args.permutations else None
+    serve(args.folder, args.host, args.port, args.cache_mb * 1024 ** 2, permutation_test, args.categories)
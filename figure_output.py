@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+'''
+This script contains the functions to save the figures of volcano_plot.py and xy_plot.py.
+
+By default every html file contains the complete plotly.js library (about 3.5 MB). With include_plotlyjs='directory' the library is written once per output folder (plotly.min.js) and the html files only load it, which makes them a few hundred kB instead.
+
+Many figures can also be collected in a single dashboard page (dashboard.html). The data of every figure is stored in a separate small file in the folder dashboard_data/ and only loaded when the figure is selected, so the page opens quickly even with hundreds of figures. The dashboard works directly from the file system, no web server is needed.
+'''
+
+import html
+import json
+import os
+from plotly.offline import get_plotlyjs, plot
+
+from instrumentation import step
+
+DASHBOARD_DATA = 'dashboard_data'
+
+def save_figure(fig, output_path, name, auto_open=True, include_plotlyjs=True):
+    # Save the figure as <name>.html and <name>.pdf in output_path.
+    # include_plotlyjs=True embeds plotly.js in the html file, 'directory' uses a shared plotly.min.js in output_path.
+    output_html = os.path.join(output_path, f"{name}.html")
+    with step('write_html', file=os.path.basename(output_html)):
+        plot(fig, filename=output_html, auto_open=auto_open, include_plotlyjs=include_plotlyjs)
+
+    output_pdf = os.path.join(output_path, f"{name}.pdf")
+    with step('write_image', file=os.path.basename(output_pdf)):
+        fig.write_image(output_pdf)
+
+def write_plotlyjs(output_path):
+    # Write the shared plotly.js library to output_path (once)
+    output_js = os.path.join(output_path, 'plotly.min.js')
+    if not os.path.exists(output_js):
+        with open(output_js, 'w', encoding='utf-8') as file:
+            file.write(get_plotlyjs())
+    return output_js
+
+def write_figure_data(fig, output_path, name):
+    # Store the data of a figure for the dashboard
+    data_folder = os.path.join(output_path, DASHBOARD_DATA)
+    os.makedirs(data_folder, exist_ok=True)
+
+    output_data = os.path.join(data_folder, f"{name}.js")
+    with open(output_data, 'w', encoding='utf-8') as file:
+        file.write(f"registerFigure({json.dumps(name)}, {fig.to_json()});\n")
+    return output_data
+
+def write_dashboard(output_path, names, title='Figures'):
+    # Write dashboard.html listing the figures stored with write_figure_data
+    write_plotlyjs(output_path)
+
+    output_html = os.path.join(output_path, 'dashboard.html')
+    with open(output_html, 'w', encoding='utf-8') as file:
+        file.write(DASHBOARD_TEMPLATE
+                   .replace('__TITLE__', html.escape(title))
+                   .replace('__DATA__', DASHBOARD_DATA)
+                   .replace('__NAMES__', json.dumps(sorted(names))))
+    return output_html
+
+DASHBOARD_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<script src="plotly.min.js"></script>
+<style>
+  body { margin: 0; display: flex; height: 100vh; font-family: sans-serif; font-size: 13px; }
+  #sidebar { width: 340px; display: flex; flex-direction: column; border-right: 1px solid #ccc; }
+  #filter { margin: 8px; padding: 4px; }
+  #list { flex: 1; overflow-y: auto; }
+  #list div { padding: 3px 8px; cursor: pointer; }
+  #list div:hover { background: #eee; }
+  #list div.selected { background: #dde6f7; }
+  #figure { flex: 1; }
+</style>
+</head>
+<body>
+<div id="sidebar">
+  <input id="filter" placeholder="Filter figures">
+  <div id="list"></div>
+</div>
+<div id="figure"></div>
+<script>
+var names = __NAMES__;
+var figures = {};
+var current = null;
+
+// Called by the data files in __DATA__/
+function registerFigure(name, figure) {
+  figures[name] = figure;
+  if (name === current) {
+    Plotly.react('figure', figure.data, figure.layout, {responsive: true});
+  }
+}
+
+function show(name) {
+  current = name;
+  document.querySelectorAll('#list div').forEach(function (item) {
+    item.classList.toggle('selected', item.textContent === name);
+  });
+  if (figures[name]) {
+    Plotly.react('figure', figures[name].data, figures[name].layout, {responsive: true});
+    return;
+  }
+  // The data of a figure is only loaded when it is selected
+  var script = document.createElement('script');
+  script.src = '__DATA__/' + encodeURIComponent(name) + '.js';
+  document.head.appendChild(script);
+}
+
+var list = document.getElementById('list');
+names.forEach(function (name) {
+  var item = document.createElement('div');
+  item.textContent = name;
+  item.onclick = function () { show(name); };
+  list.appendChild(item);
+});
+
+document.getElementById('filter').oninput = function () {
+  var text = this.value.toLowerCase();
+  list.childNodes.forEach(function (item) {
+    item.style.display = item.textContent.toLowerCase().indexOf(text) === -1 ? 'none' : '';
+  });
+};
+
+if (names.length) {
+  show(names[0]);
+}
+</script>
+</body>
+</html>
+'''
@@ -3,63 +3,51 @@
 '''
 This script is used to format proteome files such that they are suitable for running in with the scripts 'proteome_data_vis' and 'volcano_plots'. 
 The files downloaded from scaffold are '.xls' files and contain a header and two lines at the end of the file which need to be removed prior to uploading the data. After removing the header and footer, save the files as *.txt file (tab delimited) and upload them to your desired folder. The file should have 12 columns, the number of rows can be variable. Column names are: \ # \ Visible? \ Identifited Proteins(XXXX) \ Accession Number \ Alternate ID \ Molecular Weight \ Protein Grouping Ambiguity \ Taxonomy \ CONTROL \ REPLICATE_1 \ REPLICATE_2 \ REPLICATE_3 \
+Runs with more (or fewer) replicates are formatted the same way: all columns after Taxonomy except the last one are taken as replicates (named 1, 2, ..., N in the formatted file) and the last column as Control.
 
 Make sure that the annotations are listed under Identified Proteins. If there are no annotions but accession numbers instead, use the script 'annotate.py' to replace the accession number with the annotations. 
 
-USAGE: python format_proteomefile.py <foldername>
+All files of the folder can be formatted in parallel by giving the number of worker processes (default: 1).
+The formatted files can be written as tab-delimited text (tsv, default) or in one of the binary formats of table_io.py (parquet, feather).
+
+USAGE: python format_proteomefile.py <foldername> [workers] [tsv|tsv.gz|tsv.zst|parquet|feather]
 '''
 
-import glob
 import os
 import sys
+from functools import partial
 
-def format_proteomefiles(folder=''):
-    
-    selected_columns = [0, 3, 4, 9, 10, 11, 12]
+from batch import print_summary, run_per_file
+from ingest import CHUNK_SIZE, find_exports, ingest
+
+def format_proteomefile(filepath, chunk_size=CHUNK_SIZE, output_format='tsv'):
+    # Format a single Scaffold export (see ingest.py). The file is read line by line, so at most chunk_size rows are held in memory.
+    # output_format is one of the formats in table_io.py ('tsv', 'parquet' or 'feather').
+    # Returns the statistics of the file for the summary (see batch.py).
+    return ingest(filepath, index=None, output_format=output_format, chunk_size=chunk_size)
+
+def format_proteomefiles(folder='', chunk_size=CHUNK_SIZE, workers=1, output_format='tsv'):
+    # Format all Scaffold exports of the folder, on a pool of worker processes if workers > 1.
+    # Files written by the pipeline (e.g. *_formatted.txt) are not formatted again.
+    filepaths = find_exports(folder)
+    for filepath in filepaths:
+        print(f"Processing file: {os.path.basename(filepath)}")
+
+    results = run_per_file(partial(format_proteomefile, chunk_size=chunk_size, output_format=output_format), filepaths, workers)
 
-    for filepath in glob.glob(os.path.join(folder, '*.txt')):
-        filename = os.path.basename(filepath)  # Get the filename
-        print(f"Processing file: {filename}")
-        
-        # Read the original file
-        with open(filepath, 'r') as file:
-            lines = file.readlines()
-       
-        # First, rename columns such that they are compatible with the scripts.
-        header = lines[0].strip().split('\t')
-        if len(header) == 13:
-                header[3] = 'Annotation'
-                header[9] = '1'
-                header[10] = '2'
-                header[11] = '3'
-                header[12] = 'Control'
+    for result in results:
+        print(f"Formatted file written to: {result['output']}")
+    print_summary(results)
 
-        # Filter selected columns for the header
-        filtered_header = [header[i] for i in selected_columns]
-        renamed_lines = ['\t'.join(filtered_header) + '\n']
-        
-        # Read in new header and combine with the filtered columns to be written to a new file
-        for line in lines[1:]:
-            columns = line.strip().split('\t')
-            filtered_columns = [columns[i] for i in selected_columns]
-            renamed_lines.append('\t'.join(filtered_columns) + '\n')
-        
-        # Sort by accession number (index 1 in the filtered columns)
-        sorted_lines = renamed_lines[:1] + sorted(renamed_lines[1:], key=lambda x: x.split('\t')[1])
-        
-        # Write the sorted and filtered lines back to a new file
-        output_file_path = filepath.replace('.txt', '_formatted.txt')
-        
-        with open(output_file_path, 'w') as file:
-            file.writelines(sorted_lines)
-        
-        print(f"Formatted file written to: {output_file_path}")
+    return results
 
 if __name__ == "__main__": 
     
-    if len(sys.argv) !=2: # If there is more than 1 argument to call this script, it will provide guidance on how to use it.
-        print("Usage: python format_proteomefile.py <input_foldername>")
+    if len(sys.argv) not in (2, 3, 4): # If there are more than 3 arguments to call this script, it will provide guidance on how to use it.
+        print("Usage: python format_proteomefile.py <input_foldername> [workers] [tsv|tsv.gz|tsv.zst|parquet|feather]")
         sys.exit(1)
     
     folder = sys.argv[1]
-    format_proteomefiles(folder)
+    workers = int(sys.argv[2]) if len(sys.argv) >= 3 else 1
+    output_format = sys.argv[3] if len(sys.argv) == 4 else 'tsv'
+    format_proteomefiles(folder, workers=workers, output_format=output_format)
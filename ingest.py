@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+'''
+This script turns Scaffold exports (DATE_STRAIN_MEDIUM_PHASE.txt, see README.md) into annotated samples in a single pass. It combines the steps of format_proteomefile.py and annotate.py:
+    1. Select the columns used in the analysis (any number of replicates) and rename them
+    2. Sort the lines by Accession Number
+    3. Replace the annotations with the ones from the annotation file (optional)
+    4. Convert the columns to numbers
+
+Each export is read once and the annotated file (*_annotated.txt, or *_formatted.txt without annotation file) is written directly, without the intermediate formatted file. format_proteomefile.py and annotate.py use the same functions.
+The lines are sorted in chunks of chunk_size lines; larger files are sorted with an external merge sort, so memory use stays bounded when writing text files (also the compressed ones, tsv.gz and tsv.zst).
+
+USAGE: python ingest.py </path/input_foldername/> [--annotations </path/annotations_file.txt>] [--workers N] [--format tsv|tsv.gz|tsv.zst|parquet|feather]
+'''
+
+import argparse
+import glob
+import heapq
+import os
+import tempfile
+import time
+from itertools import islice
+
+import pandas as pd
+
+from annotation_index import AnnotationIndex
+from batch import print_summary, run_per_file
+from instrumentation import timed
+from table_io import COMPRESSIONS, FORMATS, is_text, open_text, write_table
+
+# Columns of the Scaffold export that are kept: #, Identified Proteins, Accession Number, followed by all replicates and Control
+METADATA_COLUMNS = [0, 3, 4]
+
+# Position of the first replicate column in the export; the replicates are followed by Control, the last column
+FIRST_REPLICATE = 9
+
+# Position of the annotation and the accession number in the selected columns
+ANNOTATION = 1
+ACCESSION = 2
+
+# Rows are sorted in memory in chunks of this many lines; larger files are sorted with an external merge sort
+CHUNK_SIZE = 200000
+
+# Number of rows of which the annotations are looked up together
+BLOCK_SIZE = 5000
+
+# Suffixes of the files written by the pipeline, which are not Scaffold exports
+OUTPUT_SUFFIXES = ('_formatted', '_annotated', '_significant')
+
+# Annotation index and settings used by the worker processes, set by _init_worker
+_index = None
+_options = {}
+
+def export_header(line):
+    # Rename the columns such that they are compatible with the scripts (replicates 1, 2, ..., N and Control).
+    # Returns the names and the positions of the selected columns; the number of replicates is taken from the header.
+    header = line.strip().split('\t')
+    selected = METADATA_COLUMNS + list(range(FIRST_REPLICATE, len(header)))
+    if len(header) > FIRST_REPLICATE + 1:
+        header[3] = 'Annotation'
+        for replicate, position in enumerate(range(FIRST_REPLICATE, len(header) - 1)):
+            header[position] = str(replicate + 1)
+        header[-1] = 'Control'
+
+    return [header[i] for i in selected], selected
+
+def export_rows(file, selected, counts=None):
+    # Selected columns of every (non-empty) line of a Scaffold export
+    for line in file:
+        columns = line.strip().split('\t')
+        if columns == ['']:
+            continue
+        if counts is not None:
+            counts['rows_in'] += 1
+        yield [columns[i] for i in selected]
+
+def table_rows(file, counts=None):
+    # Columns of every (non-empty) line of a formatted/annotated text file (after the header)
+    for line in file:
+        columns = line.strip().split('\t')
+        if columns == ['']:
+            continue
+        if counts is not None:
+            counts['rows_in'] += 1
+        yield columns
+
+def _accession(line):
+    return line.split('\t', ACCESSION + 1)[ACCESSION]
+
+def _write_run(chunk):
+    # Sort a chunk of rows and spill it to a temporary file
+    chunk.sort(key=lambda row: row[ACCESSION])
+    run = tempfile.TemporaryFile(mode='w+')
+    run.writelines('\t'.join(row) + '\n' for row in chunk)
+    run.seek(0)
+    return run
+
+def sort_rows(rows, chunk_size=CHUNK_SIZE):
+    # Sort rows by accession number. Sorting is stable, so rows with the same accession number keep their order.
+    chunk = []
+    runs = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            runs.append(_write_run(chunk))
+            chunk = []
+
+    chunk.sort(key=lambda row: row[ACCESSION])
+    if not runs:
+        yield from chunk
+        return
+
+    # Merge the chunk held in memory with the chunks written to temporary files
+    merged = heapq.merge(*runs, ('\t'.join(row) + '\n' for row in chunk), key=_accession)
+    try:
+        for line in merged:
+            yield line.rstrip('\n').split('\t')
+    finally:
+        for run in runs:
+            run.close()
+
+def annotate_rows(rows, index, counts=None):
+    # Replace the annotation of every row by the one in the AnnotationIndex ('Unknown' if it is not listed).
+    # The annotations of a block of rows are looked up at once.
+    rows = iter(rows)
+    while True:
+        block = list(islice(rows, BLOCK_SIZE))
+        if not block:
+            break
+
+        found = index.lookup({row[ACCESSION] for row in block})
+        for row in block:
+            annotation = found.get(row[ACCESSION])
+            if annotation is None:
+                annotation = 'Unknown'
+                if counts is not None:
+                    counts['unknown'] += 1
+            row[ANNOTATION] = annotation
+            yield row
+
+def write_rows(path, header, rows, counts=None, compression=None):
+    # Write the header and the rows to a tab-delimited text file (compressed with gzip or zstd if compression is given)
+    with open_text(path, 'w', compression) as file:
+        file.write('\t'.join(header) + '\n')
+        for row in rows:
+            file.write('\t'.join(row) + '\n')
+            if counts is not None:
+                counts['rows_out'] += 1
+
+def rows_to_dataframe(header, rows):
+    # Build a typed dataframe from the rows: all columns except the annotation and the accession number are numbers
+    df = pd.DataFrame(list(rows), columns=header)
+    for position, column in enumerate(df.columns):
+        if position not in (ANNOTATION, ACCESSION):
+            df[column] = pd.to_numeric(df[column], errors='coerce')
+    return df
+
+def ingest_export(filepath, index=None, chunk_size=CHUNK_SIZE, counts=None):
+    # Read a Scaffold export into a typed, accession-sorted (and annotated, if index is given) dataframe
+    with open(filepath, 'r') as file:
+        header, selected = export_header(file.readline())
+        rows = sort_rows(export_rows(file, selected, counts), chunk_size)
+        if index is not None:
+            rows = annotate_rows(rows, index, counts)
+        return rows_to_dataframe(header, rows)
+
+def output_file_path(filepath, suffix, output_format='tsv'):
+    # X.txt -> X<suffix>.<extension of the output format>
+    return os.path.splitext(filepath)[0] + suffix + FORMATS[output_format]
+
+@timed('ingest', rows=lambda result: result['rows_out'], file=0)
+def ingest(filepath, index=None, output_format='tsv', chunk_size=CHUNK_SIZE):
+    # Format (and annotate, if index is given) a single Scaffold export and write the result.
+    # Returns the statistics of the file for the summary (see batch.py).
+    start_time = time.perf_counter()
+    counts = {'rows_in': 0, 'rows_out': 0, 'unknown': 0}
+
+    output_path = output_file_path(filepath, '_formatted' if index is None else '_annotated', output_format)
+
+    if is_text(output_format):
+        # Text files (also compressed ones) are written while the rows are streamed
+        with open(filepath, 'r') as file:
+            header, selected = export_header(file.readline())
+            rows = sort_rows(export_rows(file, selected, counts), chunk_size)
+            if index is not None:
+                rows = annotate_rows(rows, index, counts)
+            write_rows(output_path, header, rows, counts, COMPRESSIONS.get(output_format))
+    else:
+        df = ingest_export(filepath, index, chunk_size, counts)
+        output_path = write_table(df, output_path, output_format)
+        counts['rows_out'] = len(df)
+
+    return {'file': os.path.basename(filepath), 'output': output_path, 'rows_in': counts['rows_in'],
+            'rows_out': counts['rows_out'], 'unknown': None if index is None else counts['unknown'],
+            'seconds': time.perf_counter() - start_time}
+
+def find_exports(folder):
+    # Scaffold exports of a folder (DATE_STRAIN_MEDIUM_PHASE.txt), without the files written by the pipeline itself
+    exports = []
+    for filepath in sorted(glob.glob(os.path.join(folder, '*.txt'))):
+        name = os.path.splitext(os.path.basename(filepath))[0]
+        if len(name.split('_')) >= 4 and not name.endswith(OUTPUT_SUFFIXES):
+            exports.append(filepath)
+    return exports
+
+def _init_worker(index, options):
+    global _index, _options
+    _index = index
+    _options = options
+
+def _ingest_worker(filepath):
+    return ingest(filepath, _index, **_options)
+
+def ingest_folder(folder, index=None, workers=1, output_format='tsv', chunk_size=CHUNK_SIZE):
+    # Ingest all Scaffold exports of a folder, on a pool of worker processes if workers > 1
+    filepaths = find_exports(folder)
+    for filepath in filepaths:
+        print(f"Processing file: {os.path.basename(filepath)}")
+
+    options = {'output_format': output_format, 'chunk_size': chunk_size}
+    results = run_per_file(_ingest_worker, filepaths, workers, initializer=_init_worker, initargs=(index, options))
+
+    for result in results:
+        print(f"Sample written to: {result['output']}")
+    print_summary(results)
+
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Format and annotate Scaffold exports in a single pass.')
+    parser.add_argument('folder', help='folder with the Scaffold exports (DATE_STRAIN_MEDIUM_PHASE.txt)')
+    parser.add_argument('--annotations', help='annotation file (accession number <tab> annotation)')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes (default: 1)')
+    parser.add_argument('--format', default='tsv', choices=list(FORMATS), help='output format (default: tsv)')
+    args = parser.parse_args()
+
+    index = None
+    if args.annotations:
+        index = AnnotationIndex(args.annotations)
+        print(index.report())
+
+    ingest_folder(args.folder, index, args.workers, args.format)
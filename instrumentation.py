@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+'''
+This script records how long the steps of the pipeline take, how many rows they process and how much memory the process used, and writes them to a run report.
+
+The scripts of the pipeline mark their main steps (reading and writing tables, merging, t-tests, writing figures, ...) with step() or timed(). Nothing is recorded unless the report is switched on, which is done by running a script through this one:
+
+    python instrumentation.py --report run.json [--profile run.prof] <script.py> [arguments of the script]
+
+Every step that finishes appends one record to the report: the name of the step (nested steps are written as outer/inner), the file it worked on (if any), the rows processed, the duration in seconds and the peak memory (RSS) of the process so far. Steps of worker processes are recorded too, with their process id. The report is written as JSON (run.json) or, if the name ends with .csv, as a CSV table with one line per step. A summary per step is printed at the end. The report is also written when the script fails, with the exit code and the error.
+
+--profile = also profile the script with cProfile and write the statistics to this file (open with python -m pstats run.prof, or snakeviz). Only the main process is profiled, so use a single worker. Sampling profilers such as py-spy need no hook: py-spy record -o profile.svg -- python <script.py> [arguments]
+
+USAGE: python instrumentation.py [--report run.json|run.csv] [--profile run.prof] <script.py> [arguments of the script]
+'''
+
+import argparse
+import cProfile
+import csv
+import functools
+import json
+import os
+import runpy
+import sys
+import time
+import traceback
+from contextlib import contextmanager
+
+# Path of the file the steps are appended to; set by run_script and inherited by the worker processes
+REPORT_ENV = 'LCMS_STEP_FILE'
+
+# Columns of the CSV report
+REPORT_COLUMNS = ['step', 'file', 'rows', 'seconds', 'peak_rss_mb', 'pid', 'start']
+
+# Names of the steps that are running in this process
+_stack = []
+
+def peak_rss_mb():
+    # Peak resident memory of this process in MB (None where the resource module is not available, e.g. on Windows)
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kB, macOS bytes
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+@contextmanager
+def step(name, **fields):
+    # Record a step of the pipeline. Fields such as file or rows can be given here or set on the
+    # yielded record inside the step (record['rows'] = n).
+    record = dict(fields)
+    step_file = os.environ.get(REPORT_ENV)
+    if not step_file:
+        yield record
+        return
+
+    _stack.append(name)
+    started = time.time()
+    start_time = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record = {'step': '/'.join(_stack), **record, 'seconds': time.perf_counter() - start_time,
+                  'peak_rss_mb': peak_rss_mb(), 'pid': os.getpid(), 'start': started}
+        _stack.pop()
+        # One line per step, so records of several processes do not get mixed up
+        with open(step_file, 'a') as file:
+            file.write(json.dumps(record, default=str) + '\n')
+
+def timed(name, rows=None, file=None):
+    # Decorator recording every call of a function as a step; rows(result) gives the rows processed
+    # and file is the position of the argument with the path of the file the function works on
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            fields = {'file': os.path.basename(str(args[file]))} if file is not None and file < len(args) else {}
+            with step(name, **fields) as record:
+                result = function(*args, **kwargs)
+                if rows is not None:
+                    record['rows'] = rows(result)
+                return result
+        return wrapper
+    return decorator
+
+def read_steps(step_file):
+    if not os.path.exists(step_file):
+        return []
+    with open(step_file, 'r') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+def write_report(report_path, run, steps):
+    # Write the run report as JSON, or as CSV (one line per step) if report_path ends with .csv
+    if report_path.endswith('.csv'):
+        with open(report_path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=REPORT_COLUMNS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(steps)
+    else:
+        with open(report_path, 'w') as file:
+            json.dump({**run, 'steps': steps}, file, indent=1, default=str)
+    return report_path
+
+def print_steps(steps):
+    # Calls, total time and rows of every step, slowest first
+    totals = {}
+    for record in steps:
+        total = totals.setdefault(record['step'], {'calls': 0, 'seconds': 0.0, 'rows': 0})
+        total['calls'] += 1
+        total['seconds'] += record['seconds']
+        total['rows'] += record.get('rows') or 0
+
+    width = max([len('step')] + [len(name) for name in totals])
+    print('step'.ljust(width) + '\tcalls\tseconds\trows')
+    for name, total in sorted(totals.items(), key=lambda item: -item[1]['seconds']):
+        print(f"{name.ljust(width)}\t{total['calls']}\t{total['seconds']:.3f}\t{total['rows']}")
+
+def run_script(script, arguments, report_path='run_report.json', profile_path=None):
+    # Run a script of the pipeline (as if called from the command line) with the steps recorded
+    step_file = os.path.abspath(report_path) + '.steps'
+    if os.path.exists(step_file):
+        os.remove(step_file)
+    os.environ[REPORT_ENV] = step_file
+
+    sys.argv = [script] + list(arguments)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    run = {'command': sys.argv, 'started': time.time()}
+
+    profiler = cProfile.Profile() if profile_path else None
+    start_time = time.perf_counter()
+    exit_code = 0
+    try:
+        if profiler is not None:
+            profiler.enable()
+        runpy.run_path(script, run_name='__main__')
+    except SystemExit as error:
+        exit_code = error.code
+    except Exception as error:
+        # Failed runs get a report too, with the error and the steps that finished before it
+        traceback.print_exc()
+        run['error'] = f"{type(error).__name__}: {error}"
+        exit_code = 1
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+
+        run.update({'seconds': time.perf_counter() - start_time, 'peak_rss_mb': peak_rss_mb(), 'exit_code': exit_code})
+        steps = read_steps(step_file)
+        write_report(report_path, run, steps)
+        if os.path.exists(step_file):
+            os.remove(step_file)
+        del os.environ[REPORT_ENV]
+
+    print_steps(steps)
+    print(f"Run report written to: {report_path}")
+    if profile_path:
+        print(f"Profile written to: {profile_path}")
+    return exit_code
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run a script of the pipeline and record the duration, rows and memory of its steps.')
+    parser.add_argument('--report', default='run_report.json', help='run report, JSON or .csv (default: run_report.json)')
+    parser.add_argument('--profile', help='also write cProfile statistics to this file')
+    parser.add_argument('script', help='script of the pipeline to run')
+    parser.add_argument('arguments', nargs=argparse.REMAINDER, help='arguments of the script')
+    args = parser.parse_args()
+
+    sys.exit(run_script(args.script, args.arguments, args.report, args.profile))
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+'''
+This script contains functions to correct p-values for multiple testing. All functions work on whole arrays of p-values at once.
+    - Benjamini-Hochberg (BH): q-values controlling the false discovery rate
+    - Storey: BH q-values multiplied by the estimated fraction of proteins that do not change (pi0), which finds more significant proteins when many proteins change
+
+statistics.py adds both as columns (BH_Q_Value, Storey_Q_Value) to every comparison. This script can also correct all comparisons of a campaign together: the p-values of all comparison files are corrected as one set of tests and written to the columns Campaign_BH_Q_Value and Campaign_Storey_Q_Value of every file.
+
+p-values that are NaN (e.g. proteins that were not detected in both conditions) are left out of the correction and get a NaN q-value.
+
+USAGE: python multiple_testing.py </path/input_foldername/>
+'''
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import timed
+from table_io import COMPRESSIONS, find_comparisons, is_text, read_table, table_format, write_table
+
+# Columns with the q-values of each correction method
+QVALUE_COLUMNS = {
+    'bh': 'BH_Q_Value',
+    'storey': 'Storey_Q_Value',
+    'campaign_bh': 'Campaign_BH_Q_Value',
+    'campaign_storey': 'Campaign_Storey_Q_Value',
+}
+
+# p-values above this are used to estimate the fraction of unchanged proteins (Storey)
+STOREY_LAMBDA = 0.5
+
+def pvalues_from_transformed(transformed_pvalues):
+    # p-values from the -log10(p-values) written by statistics.py
+    return np.power(10.0, -np.asarray(transformed_pvalues, dtype=float))
+
+def benjamini_hochberg(pvalues, pi0=1.0):
+    # Benjamini-Hochberg adjusted p-values (q-values) controlling the false discovery rate,
+    # multiplied by pi0, the fraction of tests that are not changed (1 for the classic BH procedure)
+    pvalues = np.asarray(pvalues, dtype=float)
+    qvalues = np.full(pvalues.shape, np.nan)
+
+    tested = ~np.isnan(pvalues)
+    p = pvalues[tested]
+    m = p.size
+    if m == 0:
+        return qvalues
+
+    order = np.argsort(p, kind='stable')
+    ranked = pi0 * p[order] * m / np.arange(1, m + 1)
+
+    # q-values are the cumulative minimum from the largest p-value downwards
+    ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+    q = np.empty(m)
+    q[order] = np.minimum(ranked, 1.0)
+
+    qvalues[tested] = q
+    return qvalues
+
+def storey_pi0(pvalues, lambda_=STOREY_LAMBDA):
+    # Estimated fraction of unchanged tests: p-values of unchanged tests are uniform, so about
+    # pi0 * m * (1 - lambda) of them are above lambda
+    p = np.asarray(pvalues, dtype=float)
+    p = p[~np.isnan(p)]
+    if p.size == 0:
+        return 1.0
+    return float(min(1.0, np.count_nonzero(p > lambda_) / (p.size * (1.0 - lambda_))))
+
+def storey_qvalues(pvalues, lambda_=STOREY_LAMBDA):
+    # Storey q-values: BH q-values scaled by the estimated fraction of unchanged tests
+    return benjamini_hochberg(pvalues, pi0=storey_pi0(pvalues, lambda_))
+
+def qvalue_columns(transformed_pvalues, prefix=''):
+    # BH and Storey q-values of the -log10(p-values) of a comparison, as columns for the comparison file
+    pvalues = pvalues_from_transformed(transformed_pvalues)
+    return {
+        f'{prefix}BH_Q_Value': benjamini_hochberg(pvalues),
+        f'{prefix}Storey_Q_Value': storey_qvalues(pvalues),
+    }
+
+def comparison_qvalues(df, method='bh'):
+    # q-values of a comparison table for one of the methods of QVALUE_COLUMNS. The column written by
+    # statistics.py or correct_campaign is used if the file has it; BH and Storey q-values of older
+    # comparison files are computed from Transformed_P_Value.
+    if method not in QVALUE_COLUMNS:
+        raise ValueError(f"Unknown multiple testing correction: {method} (use one of: {', '.join(QVALUE_COLUMNS)})")
+    column = QVALUE_COLUMNS[method]
+    if column in df.columns:
+        return df[column].to_numpy(dtype=float)
+    if method.startswith('campaign'):
+        raise ValueError(f"The comparison has no {column} column; run multiple_testing.py on the folder of the comparisons first")
+    return qvalue_columns(df['Transformed_P_Value'])[column]
+
+def campaign_qvalues(transformed_pvalues):
+    # Correct the p-values of all comparisons of a campaign as one set of tests.
+    # transformed_pvalues: one array of -log10(p-values) per comparison; returns one dictionary of columns per comparison.
+    lengths = [len(values) for values in transformed_pvalues]
+    if not lengths:
+        return []
+    columns = qvalue_columns(np.concatenate([np.asarray(values, dtype=float) for values in transformed_pvalues]), prefix='Campaign_')
+
+    # Split the q-values of all tests back into the comparisons
+    bounds = np.cumsum(lengths)[:-1]
+    split = {name: np.split(values, bounds) for name, values in columns.items()}
+    return [{name: split[name][i] for name in split} for i in range(len(lengths))]
+
+def _add_columns(filepath, columns):
+    # Add (or replace) columns of a comparison file, keeping its format. Text files are read as text,
+    # so all other values are written back exactly as they were.
+    fmt = table_format(filepath)
+    if is_text(fmt):
+        df = pd.read_csv(filepath, sep='\t', dtype=str, keep_default_na=False, compression=COMPRESSIONS.get(fmt))
+    else:
+        df = read_table(filepath, keep_categories=True)
+
+    for name, values in columns.items():
+        df[name] = values
+    write_table(df, filepath, fmt)
+
+def _read_transformed_pvalues(filepath):
+    fmt = table_format(filepath)
+    if is_text(fmt):
+        # round_trip: exactly the numbers written by statistics.py
+        return pd.read_csv(filepath, sep='\t', usecols=['Transformed_P_Value'], float_precision='round_trip',
+                           compression=COMPRESSIONS.get(fmt))['Transformed_P_Value'].to_numpy()
+    return read_table(filepath)['Transformed_P_Value'].to_numpy()
+
+@timed('campaign_correction', rows=sum)
+def correct_campaign(filepaths):
+    # Write the campaign-wide BH and Storey q-values to all comparison files. Returns the number of tests per file.
+    transformed_pvalues = [_read_transformed_pvalues(filepath) for filepath in filepaths]
+    for filepath, columns in zip(filepaths, campaign_qvalues(transformed_pvalues)):
+        _add_columns(filepath, columns)
+    return [len(values) for values in transformed_pvalues]
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python multiple_testing.py </path/input_foldername/>")
+        sys.exit(1)
+
+    filepaths = find_comparisons(sys.argv[1])
+    tests = correct_campaign(filepaths)
+    print(f"{sum(tests)} tests of {len(filepaths)} comparisons corrected together (Campaign_BH_Q_Value, Campaign_Storey_Q_Value)")
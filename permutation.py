@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+'''
+This script contains a permutation test that can be used instead of the Student t-test of statistics.py. With only three replicates per sample the t-test assumes normally distributed counts, which spectral counts often are not. The permutation test makes no such assumption: the t-statistic of every protein is compared with the t-statistics obtained after swapping the replicate labels of the two samples.
+
+All label swaps are computed for all proteins at once as matrix products (proteins x replicates times replicates x swaps). If the number of possible swaps (e.g. 20 for 3 vs. 3 replicates) is at most max_permutations, all of them are used (exhaustive); otherwise max_permutations random swaps are drawn with the given seed, so the results are reproducible.
+
+null = how the p-value of a protein is computed from the swapped t-statistics:
+    pooled = from the swapped t-statistics of all proteins (empirical null, default). With few replicates a protein has only a few swaps (20 for 3 vs. 3, so its smallest p-value would be 0.1); pooling the swaps of all proteins gives finer p-values.
+    protein = from the swapped t-statistics of the protein itself
+
+The swaps can be spread over several worker processes; the p-values do not depend on the number of workers. Before a long run the time needed can be estimated (a small part of the test is timed and extrapolated). This script prints this estimate for all comparisons of a folder of samples.
+
+statistics.py, run_comparisons.py, campaign.py and pipeline.py use the permutation test when a number of permutations is given.
+
+USAGE: python permutation.py </path/input_foldername/> [--permutations 1000] [--null pooled|protein] [--workers N]
+'''
+
+import argparse
+import itertools
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Number of swapped t-statistics (proteins x swaps) computed at once
+CHUNK_VALUES = 2 ** 22
+
+# Swapped t-statistics this much smaller than the observed one still count as at least as extreme
+# (the same t-statistic computed with other swaps can differ in the last digits)
+RELATIVE_TOLERANCE = 1e-9
+
+# Data of the test, handed to every worker once when the pool starts
+_values = None
+_observed = None
+_null = 'pooled'
+
+def _t_statistics(values, total, total_squares, masks):
+    # Student t-statistics (pooled variance) of all rows for every label assignment in masks
+    # (swaps x replicates, 1 = sample 1), from the sums and sums of squares of both groups
+    n = values.shape[1]
+    n1 = masks[0].sum()
+    n2 = n - n1
+    sum_1 = values @ masks.T
+    squares_1 = (values ** 2) @ masks.T
+    sum_2 = total[:, None] - sum_1
+    squares_2 = total_squares[:, None] - squares_1
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_1 = sum_1 / n1
+        mean_2 = sum_2 / n2
+        # Sums of squared deviations; tiny negative values from rounding are set to 0
+        deviations = np.maximum(squares_1 - sum_1 * mean_1, 0) + np.maximum(squares_2 - sum_2 * mean_2, 0)
+        pooled_var = deviations / (n - 2.0)
+        return (mean_1 - mean_2) / np.sqrt(pooled_var * (1.0 / n1 + 1.0 / n2))
+
+def _init_worker(values, observed, null):
+    global _values, _observed, _null
+    _values = values
+    _observed = observed
+    _null = null
+
+def _count(masks):
+    # For every protein the number of swapped t-statistics at least as extreme as the observed one,
+    # and the number of swapped t-statistics it was compared with
+    total = _values.sum(axis=1)
+    total_squares = (_values ** 2).sum(axis=1)
+    threshold = _observed * (1 - RELATIVE_TOLERANCE)
+
+    counts = np.zeros(len(_values), dtype=np.int64)
+    compared = 0
+    chunk = max(1, CHUNK_VALUES // max(1, len(_values)))
+    for start in range(0, len(masks), chunk):
+        swapped = np.abs(_t_statistics(_values, total, total_squares, masks[start:start + chunk]))
+        if _null == 'pooled':
+            # Proteins without a t-statistic (e.g. all counts 0) are not part of the null distribution
+            swapped = np.sort(swapped[~np.isnan(swapped)])
+            counts += len(swapped) - np.searchsorted(swapped, threshold, side='left')
+            compared += len(swapped)
+        else:
+            counts += (swapped >= threshold[:, None]).sum(axis=1)
+            compared += swapped.shape[1]
+    return counts, compared
+
+class PermutationTest:
+    # Permutation test of all rows of two (proteins x replicates) matrices, see the description above
+
+    def __init__(self, max_permutations=1000, seed=0, null='pooled', workers=1):
+        if null not in ('pooled', 'protein'):
+            raise ValueError(f"Unknown null distribution: {null} (use pooled or protein)")
+        if max_permutations < 1:
+            raise ValueError("max_permutations must be at least 1")
+        self.max_permutations = int(max_permutations)
+        self.seed = seed
+        self.null = null
+        self.workers = workers
+
+    def __repr__(self):
+        return f"PermutationTest(max_permutations={self.max_permutations}, seed={self.seed}, null='{self.null}')"
+
+    def is_exhaustive(self, n1, n2):
+        return math.comb(n1 + n2, n1) <= self.max_permutations
+
+    def permutations(self, n1, n2):
+        # Label assignments (swaps x replicates, 1 = sample 1); all of them (including the observed one) or random ones
+        n = n1 + n2
+        if self.is_exhaustive(n1, n2):
+            masks = np.zeros((math.comb(n, n1), n))
+            for i, group_1 in enumerate(itertools.combinations(range(n), n1)):
+                masks[i, list(group_1)] = 1
+            return masks
+
+        rng = np.random.default_rng(self.seed)
+        order = np.argsort(rng.random((self.max_permutations, n)), axis=1)
+        masks = np.zeros((self.max_permutations, n))
+        np.put_along_axis(masks, order[:, :n1], 1, axis=1)
+        return masks
+
+    def ttest(self, values_1, values_2, workers=None):
+        # Returns the t-statistics and the permutation p-values of all rows
+        a = np.asarray(values_1, dtype=float)
+        b = np.asarray(values_2, dtype=float)
+        # The t-statistics do not change when a number is subtracted from a row. Subtracting the first value keeps the
+        # sums of squares small (no cancellation) and makes rows with equal values 0, so they get nan as in the t-test.
+        values = np.hstack([a, b])
+        values = values - values[:, :1]
+        masks = self.permutations(a.shape[1], b.shape[1])
+        observed_mask = np.zeros((1, values.shape[1]))
+        observed_mask[0, :a.shape[1]] = 1
+        t_stat = _t_statistics(values, values.sum(axis=1), (values ** 2).sum(axis=1), observed_mask)[:, 0]
+        observed = np.abs(t_stat)
+
+        workers = workers or self.workers
+        if workers == 1:
+            _init_worker(values, observed, self.null)
+            results = [_count(masks)]
+        else:
+            # The swaps are split over the workers, every worker counts for all proteins
+            parts = np.array_split(masks, workers)
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(values, observed, self.null)) as pool:
+                results = list(pool.map(_count, parts))
+
+        counts = sum(counts for counts, _ in results)
+        compared = sum(compared for _, compared in results)
+
+        # The exhaustive swaps contain the observed assignment; random swaps may miss it, so it is added once (p-values are never 0)
+        if self.is_exhaustive(a.shape[1], b.shape[1]):
+            p_values = counts / max(compared, 1)
+        else:
+            p_values = (counts + 1) / (compared + 1)
+        p_values = np.where(np.isnan(t_stat), np.nan, np.minimum(p_values, 1.0))
+        return t_stat, p_values
+
+    def estimate_seconds(self, rows, n1, n2, workers=None):
+        # Time needed for one comparison of rows proteins, extrapolated from a test on (at most) 2000 random rows
+        sample_rows = min(rows, 2000)
+        masks = self.permutations(n1, n2)
+        sample_masks = masks[:max(1, min(len(masks), 50))]
+        values = np.random.default_rng(0).poisson(5, (sample_rows, n1 + n2)).astype(float)
+
+        start_time = time.perf_counter()
+        _init_worker(values, np.abs(values[:, 0]), self.null)
+        _count(sample_masks)
+        seconds = time.perf_counter() - start_time
+
+        return seconds * (rows / max(sample_rows, 1)) * (len(masks) / len(sample_masks)) / (workers or self.workers)
+
+    def describe(self, n1, n2):
+        n = math.comb(n1 + n2, n1)
+        if self.is_exhaustive(n1, n2):
+            return f"all {n} label swaps of {n1} vs. {n2} replicates"
+        return f"{self.max_permutations} random label swaps (of {n}) of {n1} vs. {n2} replicates, seed {self.seed}"
+
+def print_estimate(test, comparisons, workers=1):
+    # Print the estimated time of the permutation tests of several comparisons, given as (rows, n1, n2)
+    total = 0.0
+    estimates = {}
+    for rows, n1, n2 in comparisons:
+        if (n1, n2) not in estimates:
+            estimates[(n1, n2)] = test.estimate_seconds(1000, n1, n2, workers=1) / 1000
+            print(f"Permutation test ({test.null} null): {test.describe(n1, n2)}")
+        total += estimates[(n1, n2)] * rows
+
+    print(f"Estimated time of the permutation tests: {total / max(workers, 1):.1f} s for {len(comparisons)} comparisons on {workers} worker(s)")
+    return total / max(workers, 1)
+
+if __name__ == "__main__":
+    from run_comparisons import comparison_pairs, find_samples
+    from statistics import read_sample
+    from table_io import replicate_columns
+
+    parser = argparse.ArgumentParser(description='Estimate the time of the permutation tests of all comparisons of a folder of samples.')
+    parser.add_argument('folder', help='folder with the samples (*_formatted / *_annotated)')
+    parser.add_argument('--permutations', type=int, default=1000, help='maximum number of label swaps (default: 1000)')
+    parser.add_argument('--null', default='pooled', choices=['pooled', 'protein'], help='null distribution (default: pooled)')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes (default: 1)')
+    args = parser.parse_args()
+
+    samples = {}
+    comparisons = []
+    for file_1, file_2 in comparison_pairs(find_samples(args.folder)):
+        for filepath in (file_1, file_2):
+            if filepath not in samples:
+                df = read_sample(filepath)
+                samples[filepath] = (len(df), len(replicate_columns(df.columns)))
+        # The merged comparison has at most the proteins of both samples
+        comparisons.append((samples[file_1][0] + samples[file_2][0], samples[file_1][1], samples[file_2][1]))
+
+    print_estimate(PermutationTest(args.permutations, null=args.null), comparisons, args.workers)
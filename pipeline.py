@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+
+'''
+This script runs the whole analysis of a folder of Scaffold exports (DATE_STRAIN_MEDIUM_PHASE.txt, see README.md) and only recomputes what changed since the last run. The stages are:
+    1. ingest = format (and annotate) every export (ingest.py)
+    2. compare = compare every valid pair of samples (statistics.py, run_comparisons.py)
+    3. significant = list the significant proteins of every comparison (significant_list.py)
+    4. plots = volcano and xy plot of every comparison (volcano_plot.py, xy_plot.py)
+
+For every output file the runner stores a signature in pipeline_state.json in the input folder: the content hashes (SHA-256) of its input files, the parameters of the stage and the content hashes of the scripts of the stage. A step is only run again if its signature changed or one of its outputs is missing. So when one new sample is added to a campaign only that sample is ingested and only its comparisons (and their lists and plots) are computed. Because the signatures use the content of the files, a step whose input was rewritten with the same content is not run again either.
+Content hashes are cached in the state file by file size and modification time, so unchanged files are not read again.
+
+--annotations = annotation file (accession number <tab> annotation); without it the exports are only formatted
+--output = folder the significant lists and figures are written to (default: the input folder)
+--workers = number of worker processes (default: 1)
+--format = format of the samples and comparisons: tsv (default), tsv.gz or tsv.zst (compressed text), parquet or feather
+--float-precision = significant digits of the numbers in the text comparison files (default: full precision); smaller and faster to write
+--stages = stages to run (default: ingest,compare,significant,plots)
+--log2fc, --pvalue, --fdr = thresholds of significant_list.py; with --fdr the volcano plots also show the proteins below this false discovery rate as significant
+--method = q-values used with --fdr: bh (default), storey, campaign_bh or campaign_storey. With the campaign methods the p-values of all comparisons are corrected together after the compare stage (see multiple_testing.py)
+--categories = file with the protein categories and their keywords (see annotation_classes.py), or default (proteases and peptidases): added to the significant lists, highlighted in the xy plots and shown in the volcano plots. Each annotation is classified once per process: with one worker the result is used by both stages, with more workers every plot worker classifies the annotations of its comparisons again.
+--html = html mode of plot_batch.py (full or shared)
+--permutations = use a permutation test with at most this many label swaps instead of the t-test (see permutation.py); the estimated time is printed before the comparisons are run
+--seed, --null = random seed and null distribution (pooled or protein) of the permutation test
+--normalization = pair: every comparison is normalized on its two samples (statistics.py, default), campaign: all samples are normalized together (campaign.py)
+--force = run all steps, even if they are up to date
+--dry-run = only print the steps that would be run
+
+USAGE: python pipeline.py </path/input_foldername/> [--annotations </path/annotations_file.txt>] [--output </path/output_foldername/>] [--workers N] [--format tsv|tsv.gz|tsv.zst|parquet|feather] [--float-precision N] [--stages ingest,compare,significant,plots] [--fdr 0.05] [--method bh|storey|campaign_bh|campaign_storey] [--categories </path/categories_file.txt>|default] [--permutations N] [--seed 0] [--null pooled|protein] [--normalization pair|campaign] [--force] [--dry-run]
+'''
+
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import ingest
+import run_comparisons
+import statistics
+from annotation_index import AnnotationIndex
+from campaign import Campaign, estimate_permutations as estimate_campaign_permutations
+from instrumentation import timed
+from multiple_testing import QVALUE_COLUMNS, correct_campaign
+from permutation import PermutationTest
+from batch import print_summary, run_per_file
+from significant_list import significant_list_file
+from table_io import FORMATS, output_path, strip_extension, write_table
+
+STAGES = ['ingest', 'compare', 'significant', 'plots']
+
+# Scripts whose code is part of the signature of every step of a stage
+STAGE_CODE = {
+    'ingest': ['ingest.py', 'annotation_index.py', 'table_io.py'],
+    'compare': ['statistics.py', 'campaign.py', 'run_comparisons.py', 'permutation.py', 'multiple_testing.py', 'table_io.py'],
+    'significant': ['significant_list.py', 'annotation_classes.py', 'multiple_testing.py', 'table_io.py'],
+    'plots': ['plot_batch.py', 'volcano_plot.py', 'xy_plot.py', 'annotation_classes.py', 'figure_output.py', 'multiple_testing.py', 'table_io.py'],
+}
+
+STATE_FILE = 'pipeline_state.json'
+
+# Files are hashed in blocks of this many bytes
+HASH_BLOCK_SIZE = 1024 ** 2
+
+class PipelineState:
+    # Signatures of the steps that were run and the content hashes of the files, stored in a JSON file
+
+    def __init__(self, path):
+        self.path = path
+        self.hashes = {}
+        self.steps = {}
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                state = json.load(file)
+            self.hashes = state.get('hashes', {})
+            self.steps = state.get('steps', {})
+
+    def save(self):
+        # Write to a temporary file first, so an interrupted run never leaves a broken state file
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False) as file:
+            json.dump({'hashes': self.hashes, 'steps': self.steps}, file, indent=1, sort_keys=True)
+        os.replace(file.name, self.path)
+
+    def file_hash(self, path):
+        # SHA-256 of the content of a file, taken from the cache if size and modification time did not change
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        cached = self.hashes.get(path)
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+
+        sha = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+                sha.update(block)
+        self.hashes[path] = [stat.st_size, stat.st_mtime_ns, sha.hexdigest()]
+        return sha.hexdigest()
+
+    def signature(self, stage, inputs, params):
+        # Signature of a step: hashes of the input files, the parameters and the code of the stage
+        # (inputs that do not exist yet, e.g. samples of a dry run, have no hash)
+        content = {
+            'inputs': [self.file_hash(path) if os.path.exists(path) else None for path in inputs],
+            'params': params,
+            'code': [self.file_hash(code_path(script)) for script in STAGE_CODE[stage]],
+        }
+        return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+    def categories_hash(self, categories):
+        # Parameter of the categories: the hash of a categories file, otherwise None or 'default'
+        return self.file_hash(categories) if categories not in (None, 'default') else categories
+
+    def is_current(self, key, signature, outputs):
+        return self.steps.get(key) == signature and all(os.path.exists(path) for path in outputs)
+
+    def record(self, key, signature):
+        self.steps[key] = signature
+
+def code_path(script):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+
+def plan(state, stage, steps, params, force=False):
+    # steps: list of (key, inputs, outputs, item). Returns the steps that have to be run, with their signatures.
+    todo = []
+    for key, inputs, outputs, item in steps:
+        signature = state.signature(stage, inputs, params)
+        if force or not state.is_current(key, signature, outputs):
+            todo.append((key, signature, item))
+
+    print(f"{stage}: {len(todo)} of {len(steps)} steps to run")
+    return todo
+
+@timed('pipeline_ingest')
+def run_ingest(state, folder, annotations=None, workers=1, output_format='tsv', force=False, dry_run=False):
+    # Stage 1: Scaffold exports -> samples
+    suffix = '_formatted' if annotations is None else '_annotated'
+    inputs = [annotations] if annotations is not None else []
+
+    steps = []
+    for filepath in ingest.find_exports(folder):
+        output_file = ingest.output_file_path(filepath, suffix, output_format)
+        steps.append((f"ingest:{os.path.basename(output_file)}", [filepath] + inputs, [output_file], filepath))
+
+    todo = plan(state, 'ingest', steps, {'format': output_format}, force)
+    if dry_run or not todo:
+        return [output_file for _, _, [output_file], _ in steps]
+
+    index = AnnotationIndex(annotations) if annotations is not None else None
+    options = {'output_format': output_format, 'chunk_size': ingest.CHUNK_SIZE}
+    results = run_per_file(ingest._ingest_worker, [filepath for _, _, filepath in todo], workers,
+                           initializer=ingest._init_worker, initargs=(index, options))
+    print_summary(results)
+
+    for key, signature, _ in todo:
+        state.record(key, signature)
+    state.save()
+    return [output_file for _, _, [output_file], _ in steps]
+
+def comparison_path(file_1, file_2, output_format='tsv'):
+    # Path of the comparison file written by statistics.normalization
+    output_name = statistics.comparison_conditions(file_1, file_2)[2]
+    return output_path(os.path.join(os.path.dirname(file_1), output_name), output_format)
+
+@timed('pipeline_compare')
+def run_compare(state, samples, workers=1, output_format='tsv', normalization='pair', campaign_correction=False,
+                permutation_test=None, float_precision=None, force=False, dry_run=False):
+    # Stage 2: pairs of samples -> comparisons.
+    # With normalization='campaign' (see campaign.py) every comparison depends on all samples of the campaign.
+    # With campaign_correction=True the p-values of all comparisons are corrected together once any comparison changed.
+    # permutation_test: permutation.PermutationTest instead of the t-test (None)
+    # float_precision: significant digits of the numbers in text comparison files (None = full precision)
+    pairs = run_comparisons.comparison_pairs(samples)
+    campaign_samples = sorted({filepath for pair in pairs for filepath in pair})
+
+    steps = []
+    for file_1, file_2 in pairs:
+        output_file = comparison_path(file_1, file_2, output_format)
+        inputs = campaign_samples if normalization == 'campaign' else [file_1, file_2]
+        steps.append((f"compare:{os.path.basename(output_file)}", inputs, [output_file], (file_1, file_2)))
+
+    params = {'format': output_format, 'normalization': normalization, 'campaign_correction': campaign_correction,
+              'permutation_test': repr(permutation_test) if permutation_test is not None else None, 'float_precision': float_precision}
+    todo = plan(state, 'compare', steps, params, force)
+    output_files = [output_file for _, _, [output_file], _ in steps]
+    if dry_run or not todo:
+        return output_files
+
+    if normalization == 'campaign':
+        campaign = Campaign(campaign_samples)
+        if permutation_test is not None:
+            # One comparison after the other, with the swaps of every comparison spread over the workers
+            permutation_test.workers = workers
+            estimate_campaign_permutations(campaign, [pair for _, _, pair in todo], permutation_test)
+        for _, _, (file_1, file_2) in todo:
+            write_table(campaign.comparison(file_1, file_2, permutation_test), comparison_path(file_1, file_2, output_format), output_format, float_precision)
+    else:
+        compare_pairs(todo, workers, output_format, permutation_test, float_precision)
+
+    if campaign_correction:
+        correct_campaign([output_file for output_file in output_files if os.path.exists(output_file)])
+
+    for key, signature, _ in todo:
+        state.record(key, signature)
+    state.save()
+    return output_files
+
+def compare_pairs(todo, workers=1, output_format='tsv', permutation_test=None, float_precision=None, cache_size=2 * 1024 ** 3):
+    # Run the pairwise comparisons (statistics.py) of the steps to run.
+    # Every worker reads the samples it needs into its own store (see run_comparisons.py)
+    if permutation_test is not None:
+        run_comparisons.estimate_permutations(statistics.SampleStore(cache_size), [pair for _, _, pair in todo], permutation_test, workers)
+
+    if workers == 1:
+        run_comparisons._init_worker(cache_size, output_format, permutation_test, float_precision)
+        for _, _, (file_1, file_2) in todo:
+            run_comparisons._compare(file_1, file_2)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=run_comparisons._init_worker, initargs=(cache_size // workers, output_format, permutation_test, float_precision)) as pool:
+            for future in [pool.submit(run_comparisons._compare, file_1, file_2) for _, _, (file_1, file_2) in todo]:
+                future.result()
+
+@timed('pipeline_significant')
+def run_significant(state, comparisons, output_folder, log2fc_threshold=0.5, pvalue_threshold=1.3, fdr=None, method='bh', categories=None, force=False, dry_run=False):
+    # Stage 3: comparisons -> lists of significant proteins
+    steps = []
+    for filepath in comparisons:
+        output_file = os.path.join(output_folder, f"{strip_extension(os.path.basename(filepath))}_significant.txt")
+        steps.append((f"significant:{os.path.basename(output_file)}", [filepath], [output_file], filepath))
+
+    params = {'log2fc': log2fc_threshold, 'pvalue': pvalue_threshold, 'fdr': fdr, 'method': method, 'categories': state.categories_hash(categories)}
+    todo = plan(state, 'significant', steps, params, force)
+    if dry_run or not todo:
+        return
+
+    for key, signature, filepath in todo:
+        significant_list_file(filepath, output_folder, log2fc_threshold, pvalue_threshold, fdr, method, categories)
+        state.record(key, signature)
+    state.save()
+
+@timed('pipeline_plots')
+def run_plots(state, comparisons, output_folder, workers=1, html='full', fdr=None, method='bh', categories=None, force=False, dry_run=False):
+    # Stage 4: comparisons -> volcano and xy plots (plotly is only imported when this stage is run)
+    from plot_batch import FIGURE_NAMES, plot_batch
+
+    steps = []
+    for filepath in comparisons:
+        title = strip_extension(os.path.basename(filepath))
+        outputs = [os.path.join(output_folder, name.format(title) + extension)
+                   for name in FIGURE_NAMES.values() for extension in ('.html', '.pdf')]
+        steps.append((f"plots:{title}", [filepath], outputs, filepath))
+
+    todo = plan(state, 'plots', steps, {'html': html, 'fdr': fdr, 'method': method, 'categories': state.categories_hash(categories)}, force)
+    if dry_run or not todo:
+        return
+
+    plot_batch([filepath for _, _, filepath in todo], output_folder, workers, headless=True, html=html, fdr=fdr, method=method, categories=categories)
+
+    for key, signature, _ in todo:
+        state.record(key, signature)
+    state.save()
+
+def run_pipeline(folder, annotations=None, output_folder=None, workers=1, output_format='tsv', stages=tuple(STAGES),
+                 log2fc_threshold=0.5, pvalue_threshold=1.3, fdr=None, method='bh', html='full', normalization='pair',
+                 permutation_test=None, categories=None, float_precision=None, force=False, dry_run=False):
+    output_folder = output_folder or folder
+    os.makedirs(output_folder, exist_ok=True)
+    state = PipelineState(os.path.join(folder, STATE_FILE))
+
+    # Later stages use the outputs of the earlier ones, also if the earlier stages are not run
+    suffix = '_formatted' if annotations is None else '_annotated'
+    if 'ingest' in stages:
+        samples = run_ingest(state, folder, annotations, workers, output_format, force, dry_run)
+    else:
+        samples = [ingest.output_file_path(filepath, suffix, output_format) for filepath in ingest.find_exports(folder)]
+
+    if not dry_run:
+        samples = [sample for sample in samples if os.path.exists(sample)]
+
+    if 'compare' in stages:
+        comparisons = run_compare(state, samples, workers, output_format, normalization, method.startswith('campaign'), permutation_test, float_precision, force, dry_run)
+    else:
+        comparisons = [comparison_path(file_1, file_2, output_format) for file_1, file_2 in run_comparisons.comparison_pairs(samples)]
+
+    if not dry_run:
+        comparisons = [comparison for comparison in comparisons if os.path.exists(comparison)]
+
+    if 'significant' in stages:
+        run_significant(state, comparisons, output_folder, log2fc_threshold, pvalue_threshold, fdr, method, categories, force, dry_run)
+    if 'plots' in stages:
+        run_plots(state, comparisons, output_folder, workers, html, fdr, method, categories, force, dry_run)
+
+    if not dry_run:
+        state.save()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the analysis of a folder of Scaffold exports, recomputing only what changed.')
+    parser.add_argument('folder', help='folder with the Scaffold exports (DATE_STRAIN_MEDIUM_PHASE.txt)')
+    parser.add_argument('--annotations', help='annotation file (accession number <tab> annotation)')
+    parser.add_argument('--output', help='folder the significant lists and figures are written to (default: the input folder)')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes (default: 1)')
+    parser.add_argument('--format', default='tsv', choices=list(FORMATS), help='format of the samples and comparisons (default: tsv)')
+    parser.add_argument('--float-precision', type=int, help='significant digits of the numbers in text comparison files (default: full precision)')
+    parser.add_argument('--stages', default=','.join(STAGES), help='stages to run (default: ingest,compare,significant,plots)')
+    parser.add_argument('--log2fc', type=float, default=0.5, help='log2 fold change threshold (default: 0.5)')
+    parser.add_argument('--pvalue', type=float, default=1.3, help='-log10(p-value) threshold (default: 1.3)')
+    parser.add_argument('--fdr', type=float, help='false discovery rate (q-values) instead of the p-value threshold')
+    parser.add_argument('--method', default='bh', choices=list(QVALUE_COLUMNS), help='q-values used with --fdr (default: bh)')
+    parser.add_argument('--categories', help="categories file of the proteins (see annotation_classes.py), or default")
+    parser.add_argument('--normalization', default='pair', choices=['pair', 'campaign'],
+                        help='pair: normalize every comparison on its two samples (statistics.py, default), campaign: normalize all samples together (campaign.py)')
+    parser.add_argument('--permutations', type=int, help='permutation test with at most this many label swaps instead of the t-test')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the permutation test (default: 0)')
+    parser.add_argument('--null', default='pooled', choices=['pooled', 'protein'], help='null distribution of the permutation test (default: pooled)')
+    parser.add_argument('--html', default='full', choices=['full', 'shared'], help='html mode of the figures (see plot_batch.py)')
+    parser.add_argument('--force', action='store_true', help='run all steps, even if they are up to date')
+    parser.add_argument('--dry-run', action='store_true', help='only print the steps that would be run')
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(',')]
+    for stage in stages:
+        if stage not in STAGES:
+            parser.error(f"unknown stage: {stage} (use {', '.join(STAGES)})")
+
+    permutation_test = PermutationTest(args.permutations, args.seed, args.null) if args.permutations else None
+    run_pipeline(args.folder, args.annotations, args.output, args.workers, args.format, stages,
+                 args.log2fc, args.pvalue, args.fdr, args.method, args.html, args.normalization, permutation_test, args.categories, args.float_precision, args.force, args.dry_run)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+'''
+This script creates the volcano plots and xy plots of many comparison files (output of statistics.py) in one run, instead of calling volcano_plot.py and xy_plot.py once per file.
+
+The input is a folder (all comparison files in it are plotted) or a list of comparison files. All figures are created in a few long-running processes: the image export engine (kaleido) that writes the PDF files is started once per process and reused for every figure, instead of once per figure.
+
+--output = folder the figures are written to
+--workers = number of worker processes (default: 1)
+--plots = which plots to create: volcano, xy or both (default)
+--headless = never open the html figures in a browser (recommended for large batches)
+--html = full: every html file contains plotly.js (default), shared: plotly.js is written once to the output folder (plotly.min.js) and the html files are much smaller
+--dashboard = also collect all figures in one page, dashboard.html, that loads the data of a figure when it is selected (see figure_output.py)
+--fdr = colour the proteins with a q-value below this false discovery rate (e.g. 0.05) as significant in the volcano plots, instead of those with -log10(p-value) > 1.25
+--xy = dense mode of the xy plots: auto (default, dense above 5000 proteins), dense or full (see xy_plot.py)
+--error-bars = draw error bars in the xy plots also in dense mode
+--method = q-values used with --fdr: bh (default), storey, campaign_bh or campaign_storey (see multiple_testing.py)
+--categories = file with the protein categories and their keywords (see annotation_classes.py), or default: highlighted in the xy plots (default: proteases and peptidases) and shown in the hover text of the volcano plots. Each annotation is classified once per worker, not once per plot.
+
+USAGE: python plot_batch.py </path/input_foldername/ or input files> --output </path/output_foldername/> [--workers N] [--plots volcano,xy] [--headless] [--html full|shared] [--dashboard] [--fdr 0.05] [--method bh|storey|campaign_bh|campaign_storey] [--xy auto|dense|full] [--error-bars] [--categories </path/categories_file.txt>|default]
+'''
+
+import argparse
+import atexit
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from figure_output import write_dashboard, write_figure_data, write_plotlyjs
+from multiple_testing import QVALUE_COLUMNS
+from table_io import find_comparisons, strip_extension
+from volcano_plot import volcano_plot_file
+from xy_plot import DENSE_MODES, xy_plot_file
+
+PLOTS = {
+    'volcano': volcano_plot_file,
+    'xy': xy_plot_file,
+}
+
+# Names of the figures of a comparison file, as used for the output files
+FIGURE_NAMES = {
+    'volcano': 'volcano_{}',
+    'xy': '{}',
+}
+
+# Settings used by the worker processes, set by _init_worker
+_options = {}
+
+def browser_found():
+    # Whether kaleido >= 1.0 finds a browser (Chrome/Chromium, also BROWSER_PATH and the one installed by kaleido_get_chrome).
+    # False if the browser cannot be looked up with the installed version of choreographer.
+    try:
+        from choreographer.browsers.chromium import Chromium
+        return Chromium.find_browser(skip_local=False) is not None
+    except (ImportError, AttributeError, TypeError):
+        return False
+
+def start_image_engine():
+    # Start the image export engine once for this process. kaleido >= 1.0 starts a new browser for every
+    # figure unless a server is running; older kaleido versions keep their engine running on their own.
+    try:
+        import kaleido
+    except ImportError:
+        return
+
+    # Without a browser the server waits forever; every figure is then exported on its own, which fails
+    # at once with the error message of plotly
+    if hasattr(kaleido, 'start_sync_server') and browser_found():
+        kaleido.start_sync_server(silence_warnings=True)
+        atexit.register(kaleido.stop_sync_server, silence_warnings=True)
+
+def _init_worker(options):
+    global _options
+    _options = options
+    start_image_engine()
+
+def plot_file(inputfile):
+    # Create the selected plots of one comparison file, returns the time needed and the names of the figures
+    start_time = time.perf_counter()
+    title = strip_extension(os.path.basename(inputfile))
+    include_plotlyjs = 'directory' if _options['html'] == 'shared' else True
+
+    # Options of the single plots: the significance of the volcano plots, the dense mode of the xy plots, the categories of both
+    plot_options = {
+        'volcano': {'fdr': _options['fdr'], 'method': _options['method'], 'categories': _options['categories']},
+        'xy': {'dense': DENSE_MODES[_options['xy']], 'error_bars': True if _options['error_bars'] else None, 'categories': _options['categories']},
+    }
+
+    names = []
+    for plot_name in _options['plots']:
+        fig = PLOTS[plot_name](inputfile, _options['output_folder'], auto_open=not _options['headless'], include_plotlyjs=include_plotlyjs,
+                               **plot_options[plot_name])
+        names.append(FIGURE_NAMES[plot_name].format(title))
+        if _options['dashboard']:
+            write_figure_data(fig, _options['output_folder'], names[-1])
+
+    return time.perf_counter() - start_time, names
+
+def plot_batch(inputs, output_folder, workers=1, plots=tuple(PLOTS), headless=False, html='full', dashboard=False, fdr=None, method='bh',
+               xy='auto', error_bars=False, categories=None):
+    # html='full' embeds plotly.js in every html file, html='shared' writes it once to the output folder.
+    # dashboard=True also collects all figures in output_folder/dashboard.html.
+    # fdr and method: significance of the volcano plots from the q-values (see volcano_plot.py)
+    # xy and error_bars: dense mode of the xy plots (auto, dense or full) and error bars also in dense mode (see xy_plot.py)
+    # categories: categories file of the proteins or 'default' (see annotation_classes.py)
+    # inputs: a folder or a list of folders/comparison files
+    if isinstance(inputs, str):
+        inputs = [inputs]
+
+    files = []
+    for path in inputs:
+        files.extend(find_comparisons(path) if os.path.isdir(path) else [path])
+
+    os.makedirs(output_folder, exist_ok=True)
+    options = {'output_folder': output_folder, 'plots': list(plots), 'headless': headless, 'html': html, 'dashboard': dashboard,
+               'fdr': fdr, 'method': method, 'xy': xy, 'error_bars': error_bars, 'categories': categories}
+    print(f"Plotting {len(files)} comparison files ({', '.join(plots)}) to: {output_folder}")
+
+    # The shared plotly.js is written before the workers start, so they do not write it at the same time
+    if html == 'shared':
+        write_plotlyjs(output_folder)
+
+    if workers == 1:
+        _init_worker(options)
+        results = [plot_file(filepath) for filepath in files]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(options,)) as pool:
+            results = list(pool.map(plot_file, files))
+
+    for filepath, (seconds, names) in zip(files, results):
+        print(f"{os.path.basename(filepath)}\t{seconds:.2f} s")
+
+    if dashboard:
+        output_html = write_dashboard(output_folder, [name for _, names in results for name in names])
+        print(f"Dashboard written to: {output_html}")
+    return files
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Create volcano and xy plots of many comparison files in one run.')
+    parser.add_argument('inputs', nargs='+', help='folder(s) with comparison files or comparison files')
+    parser.add_argument('--output', required=True, help='folder the figures are written to')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes (default: 1)')
+    parser.add_argument('--plots', default=','.join(PLOTS), help='plots to create: volcano, xy or volcano,xy (default)')
+    parser.add_argument('--headless', action='store_true', help='never open the html figures in a browser')
+    parser.add_argument('--html', default='full', choices=['full', 'shared'],
+                        help='full: plotly.js in every html file (default), shared: one plotly.min.js per output folder')
+    parser.add_argument('--dashboard', action='store_true', help='also collect all figures in dashboard.html')
+    parser.add_argument('--fdr', type=float, help='colour proteins with a q-value below this FDR as significant in the volcano plots')
+    parser.add_argument('--xy', default='auto', choices=list(DENSE_MODES), help='dense mode of the xy plots (default: auto, dense above 5000 proteins)')
+    parser.add_argument('--error-bars', action='store_true', help='draw error bars in the xy plots also in dense mode')
+    parser.add_argument('--categories', help="categories file of the proteins (see annotation_classes.py), or default")
+    parser.add_argument('--method', default='bh', choices=list(QVALUE_COLUMNS), help='q-values used with --fdr (default: bh)')
+    args = parser.parse_args()
+
+    plots = [name.strip() for name in args.plots.split(',')]
+    for name in plots:
+        if name not in PLOTS:
+            parser.error(f"unknown plot: {name} (use volcano and/or xy)")
+
+    plot_batch(args.inputs, args.output, args.workers, plots, args.headless, args.html, args.dashboard, args.fdr, args.method, args.xy, args.error_bars, args.categories)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+'''
+This script runs statistics.py on all valid pairs of samples in a folder. It replaces the shell loop in run_statistics.sh.
+
+All files with the extension *_annotated.txt (or *_formatted.txt if a sample was not annotated, and the same files in the binary formats of table_io.py) are collected and paired according to the DATE_STRAIN_MEDIUM_PHASE naming rules used in statistics.py: two samples are compared if they are from the same strain and share either the medium or the growth phase. Every pair is compared once (a file is never compared with itself), in alphabetical order of the filenames.
+
+The comparisons are distributed over a pool of worker processes, so the Python and pandas start-up costs are paid once per worker instead of once per pair. Only the file paths are sent to the workers: every worker reads the samples it needs into its own statistics.SampleStore and keeps them for its next comparisons. The pairs are handed out in alphabetical order, so consecutive comparisons of a worker mostly share a sample.
+
+workers = number of worker processes (default: number of CPUs)
+cache_size = maximum memory in bytes used for the parsed samples, shared by the workers (default: 2 GB)
+output_format = format of the comparison files: tsv (default), tsv.gz, tsv.zst (compressed text), parquet or feather
+permutations = use a permutation test with at most this many label swaps instead of the t-test (see permutation.py); the estimated time is printed before the comparisons start
+
+USAGE: python run_comparisons.py </path/input_foldername/> [workers] [tsv|tsv.gz|tsv.zst|parquet|feather] [permutations]
+'''
+
+import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import statistics
+from permutation import PermutationTest, print_estimate
+from table_io import FORMAT_PREFERENCE, FORMATS
+
+# Samples read by this worker, the output format, the permutation test (None = t-test) and the
+# precision of the numbers in text files (None = full), set in every worker once when the pool starts
+_store = None
+_output_format = 'tsv'
+_permutation_test = None
+_float_precision = None
+
+def find_samples(folder):
+    # Collect one file per sample, preferring the annotated over the formatted version
+    # (and the binary formats over the text files if a sample was written in several formats)
+    samples = {}
+    for suffix in ('_formatted', '_annotated'):
+        for fmt in FORMAT_PREFERENCE:
+            extension = FORMATS[fmt]
+            for filepath in sorted(glob.glob(os.path.join(folder, '*' + suffix + extension))):
+                samples[filepath[:-len(suffix + extension)]] = filepath
+
+    return [samples[sample] for sample in sorted(samples)]
+
+def comparison_pairs(files):
+    # All valid (file_1, file_2) comparisons, each pair only once
+    pairs = []
+    for i, file_1 in enumerate(files):
+        for file_2 in files[i + 1:]:
+            if statistics.comparison_conditions(file_1, file_2) is not None:
+                pairs.append((file_1, file_2))
+
+    return pairs
+
+def _init_worker(cache_size, output_format, permutation_test=None, float_precision=None):
+    global _store, _output_format, _permutation_test, _float_precision
+    _store = statistics.SampleStore(cache_size)
+    _output_format = output_format
+    _permutation_test = permutation_test
+    _float_precision = float_precision
+
+def _compare(file_1, file_2):
+    return statistics.normalization(file_1, file_2, store=_store, output_format=_output_format, permutation_test=_permutation_test,
+                                    float_precision=_float_precision)
+
+def estimate_permutations(store, pairs, permutation_test, workers=None):
+    # Print the estimated time of the permutation tests of all pairs (samples taken from the store)
+    comparisons = []
+    for file_1, file_2 in pairs:
+        sample_1 = store.get(file_1)
+        sample_2 = store.get(file_2)
+        comparisons.append((len(sample_1.df) + len(sample_2.df), len(sample_1.replicates), len(sample_2.replicates)))
+    return print_estimate(permutation_test, comparisons, workers or os.cpu_count())
+
+def run_comparisons(folder, workers=None, cache_size=2 * 1024 ** 3, output_format='tsv', permutation_test=None, float_precision=None):
+    files = find_samples(folder)
+    pairs = comparison_pairs(files)
+    print(f"Found {len(files)} samples and {len(pairs)} comparisons in: {folder}")
+
+    if not pairs:
+        return []
+
+    # The comparisons run in parallel, so every permutation test runs in one process
+    workers = workers or os.cpu_count()
+    if permutation_test is not None:
+        estimate_permutations(statistics.SampleStore(cache_size), pairs, permutation_test, workers)
+
+    # Every worker has its own store, the memory for the samples is split between them
+    output_files = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(cache_size // workers, output_format, permutation_test, float_precision)) as pool:
+        futures = [pool.submit(_compare, file_1, file_2) for file_1, file_2 in pairs]
+        for future in as_completed(futures):
+            output_files.append(future.result())
+
+    print(f"{len(output_files)} comparisons written to: {folder}")
+    return sorted(output_files)
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3, 4, 5):
+        print("Usage: python run_comparisons.py </path/input_foldername/> [workers] [tsv|tsv.gz|tsv.zst|parquet|feather] [permutations]")
+        sys.exit(1)
+
+    folder = sys.argv[1]
+    workers = int(sys.argv[2]) if len(sys.argv) >= 3 else None
+    output_format = sys.argv[3] if len(sys.argv) >= 4 else 'tsv'
+    permutation_test = PermutationTest(int(sys.argv[4])) if len(sys.argv) == 5 else None
+    run_comparisons(folder, workers, output_format=output_format, permutation_test=permutation_test)
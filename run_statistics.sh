@@ -1,15 +1,10 @@
 #!/bin/bash
 
-# This script is to run statistics.py file on all files with all files in a specific directory. 
-# usage: bash run_statistics.sh ˜/INPUT/DIRECTORY/
+# This script runs statistics.py on all valid pairs of files in a specific directory.
+# It is a wrapper around run_comparisons.py, which reads every file once and runs the comparisons in parallel.
+# usage: bash run_statistics.sh ˜/INPUT/DIRECTORY/ [workers]
 
 directory="$1"
+script_directory="$(cd "$(dirname "$0")" && pwd)"
 
-for file1 in "$directory/*annotated.txt"
-do
-	for file2 in "$directory/*annotated.txt"
-	do 
-		python /Users/fadimestemmer/Desktop/Saito_Lab/Bioinformatics/LCMS_Proteomics_Data_Evaluation/statistics.py "$file1" "$file2"
-	done
-done
-
+python "$script_directory/run_comparisons.py" "$directory" ${2:+"$2"}
@@ -3,87 +3,119 @@
 '''
 This script extracts significant values (log2 fold change > 0.5 & -log10(p-value) > 1.3) from proteome data.
 
-USAGE: python significant.py </path/input_filename> </path/output_folder/>
+The thresholds can be changed: log2fc_threshold for the absolute log2 fold change and pvalue_threshold for -log10(p-value). If fdr is given (e.g. 0.05), proteins with a q-value below fdr are significant instead. method selects the q-values (see multiple_testing.py):
+    bh = Benjamini-Hochberg (default), storey = Storey, campaign_bh / campaign_storey = corrected over all comparisons of the campaign (run multiple_testing.py on the folder first)
+
+If a categories file (or 'default' for proteases and peptidases) is given (see annotation_classes.py), the category of every protein is added (Category +, Category -).
+
+USAGE: python significant.py </path/input_filename> </path/output_folder/> [log2fc_threshold] [pvalue_threshold] [fdr|none] [bh|storey|campaign_bh|campaign_storey] [</path/categories_file.txt>]
 '''
 
+import numpy as np
 import pandas as pd
 import sys
 import os
 
-def significant_list(title, log2_fold_change, transformed_pvalues, annotations, accessions, output_path):
-    # Create lists to store the significant points and their annotations
-    sign_plus = []
-    sign_minus = []
-    accession_sign_plus = []
-    accession_sign_minus = []
-
-    for i in range(len(log2_fold_change)):
-        if transformed_pvalues[i] > 1.3:
-            if log2_fold_change[i] > 0.5:
-                sign_plus.append(annotations[i])
-                accession_sign_plus.append(accessions[i])
-                sign_minus.append(None)  # No value for underexpressed in this case
-                accession_sign_minus.append(None)
-            elif log2_fold_change[i] < -0.5:
-                sign_plus.append(None)  # No value for overexpressed in this case
-                accession_sign_plus.append(None)
-                sign_minus.append(annotations[i])
-                accession_sign_minus.append(accessions[i])
-            else:
-                # Not adding anything if the log2 fold change is between -0.5 and 0.5
-                sign_plus.append(None)
-                accession_sign_plus.append(None)
-                sign_minus.append(None)
-                accession_sign_minus.append(None)
-        else:
-            sign_plus.append(None)
-            accession_sign_plus.append(None)
-            sign_minus.append(None)
-            accession_sign_minus.append(None)
-
-    # Create a DataFrame to save the significant points and their annotations
+from annotation_classes import load_classifier
+from instrumentation import timed
+from multiple_testing import QVALUE_COLUMNS, benjamini_hochberg, comparison_qvalues, pvalues_from_transformed
+from table_io import comparison_columns, read_columns, read_header, strip_extension
+
+HEADER = ['Significant_Overexpressed', 'Accession Number +', 'Significant_Underexpressed', 'Accession Number -']
+
+def classify(log2_fold_change, transformed_pvalues, log2fc_threshold=0.5, pvalue_threshold=1.3, fdr=None, qvalues=None):
+    # Boolean masks of the significantly over- and underexpressed proteins.
+    # A protein is significant if -log10(p-value) > pvalue_threshold, or, if fdr is given,
+    # if its q-value is below fdr (Benjamini-Hochberg q-values unless qvalues are given).
+    log2_fold_change = np.asarray(log2_fold_change, dtype=float)
+    transformed_pvalues = np.asarray(transformed_pvalues, dtype=float)
+
+    if fdr is None:
+        significant = transformed_pvalues > pvalue_threshold
+    elif qvalues is None:
+        significant = benjamini_hochberg(pvalues_from_transformed(transformed_pvalues)) < fdr
+    else:
+        significant = np.asarray(qvalues, dtype=float) < fdr
+
+    overexpressed = significant & (log2_fold_change > log2fc_threshold)
+    underexpressed = significant & (log2_fold_change < -log2fc_threshold)
+    return overexpressed, underexpressed
+
+def write_significant(significant_df, output_filename):
+    # Write the table at once; missing values are written as None
+    header = list(significant_df.columns)
+    columns = [significant_df[column].astype(object).where(significant_df[column].notna(), None).astype(str)
+               for column in header]
+    lines = columns[0]
+    for column in columns[1:]:
+        lines = lines + '\t' + column
+
+    with open(output_filename, 'w') as f:
+        f.write('\t'.join(header) + '\n')
+        if len(lines):
+            f.write('\n'.join(lines) + '\n')
+
+@timed('significant_list', rows=len)
+def significant_list(title, log2_fold_change, transformed_pvalues, annotations, accessions, output_path,
+                     log2fc_threshold=0.5, pvalue_threshold=1.3, fdr=None, qvalues=None, categories=None):
+    # categories: category of every protein (see annotation_classes.py), added to the list if given
+    overexpressed, underexpressed = classify(log2_fold_change, transformed_pvalues, log2fc_threshold, pvalue_threshold, fdr, qvalues)
+    annotations = np.asarray(annotations, dtype=object)
+    accessions = np.asarray(accessions, dtype=object)
+
+    # Keep the significant points in their original order, each with either the over- or the underexpressed columns filled
+    rows = np.flatnonzero(overexpressed | underexpressed)
+    up = overexpressed[rows]
     significant_df = pd.DataFrame({
-        'Significant_Overexpressed': sign_plus,
-        'Accession Number +': accession_sign_plus,
-        'Significant_Underexpressed': sign_minus,
-        'Accession Number -': accession_sign_minus
-    })
+        'Significant_Overexpressed': np.where(up, annotations[rows], None),
+        'Accession Number +': np.where(up, accessions[rows], None),
+        'Significant_Underexpressed': np.where(up, None, annotations[rows]),
+        'Accession Number -': np.where(up, None, accessions[rows])
+    }, index=rows)
 
-    # Drop rows with all None values
-    significant_df.dropna(how='all', inplace=True)
+    if categories is not None:
+        categories = np.asarray(categories, dtype=object)
+        significant_df.insert(2, 'Category +', np.where(up, categories[rows], None))
+        significant_df['Category -'] = np.where(up, None, categories[rows])
 
     # Write the DataFrame to a tab-delimited text file
     output_filename = os.path.join(output_path, f"{title}_significant.txt")
-    with open(output_filename, 'w') as f:
-        # Write the header
-        f.write('Significant_Overexpressed\tAccession Number +\tSignificant_Underexpressed\tAccession Number -\n')
-        # Write each row, ensuring fields with special characters are preserved
-        for index, row in significant_df.iterrows():
-            f.write(
-                f"{row['Significant_Overexpressed']}\t"
-                f"{row['Accession Number +']}\t"
-                f"{row['Significant_Underexpressed']}\t"
-                f"{row['Accession Number -']}\n"
-            )
+    write_significant(significant_df, output_filename)
     return significant_df
 
+def significant_list_file(inputfile, output_path, log2fc_threshold=0.5, pvalue_threshold=1.3, fdr=None, method='bh', categories=None):
+    # Create the list of significant proteins of a comparison file from statistics.py.
+    # Only the relevant columns are read (by name, so files with any number of replicates work),
+    # the numbers as 64-bit floats so the thresholds are applied to the exact values.
+    columns = comparison_columns(read_header(inputfile))
+    needed = [columns[name] for name in ('log2_fold_change', 'transformed_pvalue', 'annotation', 'accession')]
+    if fdr is not None:
+        needed.append(QVALUE_COLUMNS.get(method, method))
+    df = read_columns(inputfile, needed, float_dtype='float64')
+
+    log2_fold_change = df[columns['log2_fold_change']]
+    transformed_pvalues = df[columns['transformed_pvalue']]
+    annotations = df[columns['annotation']]
+    accessions = df[columns['accession']]
+    qvalues = comparison_qvalues(df, method) if fdr is not None else None
+    protein_categories = load_classifier(categories).classify(annotations) if categories is not None else None
+
+    title = strip_extension(os.path.basename(inputfile))
+    
+    return significant_list(title, log2_fold_change=log2_fold_change, transformed_pvalues=transformed_pvalues, annotations=annotations, accessions=accessions, output_path=output_path,
+                            log2fc_threshold=log2fc_threshold, pvalue_threshold=pvalue_threshold, fdr=fdr, qvalues=qvalues, categories=protein_categories)
+
 if __name__ == "__main__": 
-    if len(sys.argv) != 3:  # Check if there are exactly 2 arguments
-        print("Usage: python significant.py </path/input_filename> </path/output_folder/>")
+    if len(sys.argv) not in (3, 4, 5, 6, 7, 8):  # Check if there are 2 to 7 arguments
+        print("Usage: python significant.py </path/input_filename> </path/output_folder/> [log2fc_threshold] [pvalue_threshold] [fdr|none] [bh|storey|campaign_bh|campaign_storey] [</path/categories_file.txt>]")
         sys.exit(1)
     
     inputfile = sys.argv[1]
     output_path = sys.argv[2]
+    log2fc_threshold = float(sys.argv[3]) if len(sys.argv) >= 4 else 0.5
+    pvalue_threshold = float(sys.argv[4]) if len(sys.argv) >= 5 else 1.3
+    fdr = float(sys.argv[5]) if len(sys.argv) >= 6 and sys.argv[5] != 'none' else None
+    method = sys.argv[6] if len(sys.argv) >= 7 else 'bh'
+    categories = sys.argv[7] if len(sys.argv) == 8 else None
 
-    # Load the input file into a DataFrame
-    df = pd.read_csv(inputfile, sep='\t')
-
-    # Extract the relevant columns
-    log2_fold_change = df.iloc[:, 23]
-    transformed_pvalues = df.iloc[:, 24]
-    annotations = df.iloc[:, 1] 
-    accessions = df.iloc[:, 2]
-
-    title = os.path.basename(inputfile).replace(".txt", "")
-    
-    significant_list(title, log2_fold_change=log2_fold_change, transformed_pvalues=transformed_pvalues, annotations=annotations, accessions=accessions, output_path=output_path)
\ No newline at end of file
+    significant_list_file(inputfile, output_path, log2fc_threshold, pvalue_threshold, fdr, method, categories)
@@ -9,26 +9,134 @@ This script is used to generate statistics important for creating xy-plots and v
     5. Determine log2fold changes
     6. Calculate p-values
 
-USAGE: python statistics.py </path/input_filename_1> </path/input_filename_2/>
+Instead of the Student t-test, a permutation test (see permutation.py) can be used by giving the maximum number of permutations (label swaps).
+The q-values of the comparison (Benjamini-Hochberg and Storey, see multiple_testing.py) are added after the p-values as BH_Q_Value and Storey_Q_Value.
+The replicate columns (1, 2, ..., N) are found from the header, so samples with any number of replicates can be compared (also with different numbers in the two samples). The comparison file has one norms_<replicate>_<condition> column per replicate.
+The input files can be tab-delimited text files (also gzip or zstd compressed) or in one of the binary formats of table_io.py. The output is written as text (tsv, default), compressed text (tsv.gz, tsv.zst), parquet or feather.
+
+USAGE: python statistics.py </path/input_filename_1> </path/input_filename_2/> [tsv|tsv.gz|tsv.zst|parquet|feather] [permutations]
 '''
 
 import os
 import sys
+from collections import OrderedDict
 import pandas as pd
 import numpy as np
-import scipy.stats as stats
+from scipy import special
+
+from instrumentation import step
+from multiple_testing import qvalue_columns
+from permutation import PermutationTest
+from table_io import AnnotationDictionary, UNKNOWN_ANNOTATION, read_header, read_table, replicate_columns, write_table
+
+def accession_index(df, name='sample'):
+    # Index of the accession numbers of a sample. Raises a ValueError if an accession number is listed
+    # more than once (the merge would pair every copy with every other one).
+    # Checking the order first is faster: sorted accession numbers without repeats are unique without hashing them.
+    accessions = pd.Index(df['Accession Number'])
+    if accessions.is_monotonic_increasing and accessions.is_unique:
+        return accessions
+
+    if not accessions.is_unique:
+        duplicated = accessions[accessions.duplicated()].unique()
+        shown = ', '.join(str(accession) for accession in duplicated[:5])
+        raise ValueError(f"{name} lists {len(duplicated)} accession numbers more than once: {shown}")
+    return accessions
+
+def fill_numeric(values):
+    # Missing values of a numeric column are set to 0
+    if values.dtype.kind == 'f':
+        values = np.where(np.isnan(values), 0, values)
+    return values
+
+def fill_annotations(values):
+    # Missing annotations (and 0) are set to "Unknown". Annotations encoded by an AnnotationDictionary
+    # stay codes: only the missing rows get the code of "Unknown".
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = pd.Categorical(values)
+        if UNKNOWN_ANNOTATION not in values.categories:
+            values = values.add_categories(UNKNOWN_ANNOTATION)
+        missing = values.codes < 0
+        if 0 in values.categories:
+            missing |= values.codes == values.categories.get_loc(0)
+        codes = np.where(missing, values.categories.get_loc(UNKNOWN_ANNOTATION), values.codes)
+        return pd.Categorical.from_codes(codes, dtype=values.dtype)
+
+    values = np.asarray(values, dtype=object)
+    return np.where(pd.isna(values) | (values == 0), UNKNOWN_ANNOTATION, values)
+
+def suffixed_columns(columns_1, columns_2):
+    # Columns that get the suffix of their sample in the merged table: the columns of both samples and all replicate
+    # columns, also those only one sample has (e.g. replicate 4 of 4 vs. 3 replicates)
+    shared = set(columns_1) & set(columns_2)
+    return (shared | set(replicate_columns(columns_1)) | set(replicate_columns(columns_2))) - {'Accession Number'}
+
+def merge_sorted(df1, df2, suf_1='', suf_2='', accessions_1=None, accessions_2=None):
+    # Outer join of two samples sorted by unique accession numbers, the same table as pd.merge(how="outer")
+    # with missing numbers set to 0: the rows are the sorted union of the accession numbers, the columns of df1
+    # and then those of df2 (see suffixed_columns for the columns that get the suffixes), and numeric columns of a sample with missing
+    # rows become float. Missing text (e.g. annotations) stays NaN; categorical annotations keep their codes (-1 = missing).
+    # The sorted accession numbers are joined in one linear pass; rows_1 / rows_2 give the row of every
+    # accession number in df1 / df2 (-1 where it is missing, None if df1 and df2 have the same accession numbers).
+    if accessions_1 is None:
+        accessions_1 = accession_index(df1)
+    if accessions_2 is None:
+        accessions_2 = accession_index(df2)
+    accessions, rows_1, rows_2 = accessions_1.join(accessions_2, how='outer', return_indexers=True)
+
+    suffixed = suffixed_columns(df1.columns, df2.columns)
+    columns = {}
+    for df, rows, suffix, first in ((df1, rows_1, suf_1, True), (df2, rows_2, suf_2, False)):
+        missing = None if rows is None else rows < 0
+        for column in df.columns:
+            if column == 'Accession Number':
+                if first:
+                    columns[column] = accessions.to_numpy()
+                continue
+            name = column + suffix if column in suffixed else column
+            if isinstance(df[column].dtype, pd.CategoricalDtype):
+                # Encoded annotations: only the codes are joined
+                values = df[column].array
+                if rows is not None:
+                    values = pd.Categorical.from_codes(np.where(missing, -1, values.codes[rows]), dtype=values.dtype)
+                columns[name] = values
+                continue
+
+            values = df[column].to_numpy()
+            numeric = pd.api.types.is_numeric_dtype(values.dtype)
+            if missing is not None and missing.any():
+                # Preallocated column of the merged table, filled with 0 (numbers) or NaN (text) where rows are missing
+                merged = np.zeros(len(accessions)) if numeric else np.full(len(accessions), np.nan, dtype=object)
+                merged[~missing] = values[rows[~missing]]
+                values = merged
+            elif rows is not None:
+                values = values[rows]
+            columns[name] = fill_numeric(values) if numeric else values
+
+    return pd.DataFrame(columns)
 
 def merge_and_format(df1, df2, suf_1='', suf_2=''):
-    # Merge the dataframes based on "Accession Number"
-    merged_df = pd.merge(df1, df2, on="Accession Number", how="outer", suffixes=(suf_1, suf_2))
-    
-    # Fill missing values with 0
-    merged_df.fillna(0, inplace=True)
-    
-    # Replace 0 in annotations with "Unknown"
-    merged_df[f'Annotation{suf_1}'] = merged_df[f'Annotation{suf_1}'].replace(0, "Unknown")
-    merged_df[f'Annotation{suf_2}'] = merged_df[f'Annotation{suf_2}'].replace(0, "Unknown")
-    
+    # Merge the dataframes based on "Accession Number". Samples sorted by accession number (as written by
+    # format_proteomefile.py) are joined in one pass over the sorted keys, others with pd.merge.
+    accessions_1 = accession_index(df1, f'Sample {suf_1}'.strip())
+    accessions_2 = accession_index(df2, f'Sample {suf_2}'.strip())
+    if accessions_1.is_monotonic_increasing and accessions_2.is_monotonic_increasing:
+        merged_df = merge_sorted(df1, df2, suf_1, suf_2, accessions_1, accessions_2)
+    else:
+        # pd.merge only adds the suffixes to the columns of both samples
+        suffixed = suffixed_columns(df1.columns, df2.columns)
+        renamed_1 = {column: column + suf_1 for column in suffixed if column not in df2.columns}
+        renamed_2 = {column: column + suf_2 for column in suffixed if column not in df1.columns}
+        merged_df = pd.merge(df1.rename(columns=renamed_1), df2.rename(columns=renamed_2), on="Accession Number", how="outer", suffixes=(suf_1, suf_2))
+        # Fill missing values with 0 (only the numeric columns)
+        for column in merged_df.columns:
+            if pd.api.types.is_numeric_dtype(merged_df[column].dtype):
+                merged_df[column] = fill_numeric(merged_df[column].to_numpy())
+
+    # Replace missing annotations with "Unknown"
+    for annotation in (f'Annotation{suf_1}', f'Annotation{suf_2}'):
+        merged_df[annotation] = fill_annotations(merged_df[annotation])
+
     return merged_df
 
 def calculate_log2(df1, df2):
@@ -36,94 +144,243 @@ def calculate_log2(df1, df2):
     log2.fillna(0, inplace=True)
     return log2
 
-def calculate_pvalue(df1, df2):
-    num_values = df1.shape[0]
-    p_values = []
-    
-    for row in range(num_values):
-        ttest_result = stats.ttest_ind(df1.iloc[row].values, df2.iloc[row].values)
-        p_values.append(ttest_result.pvalue)
-    
-    transformed_pvals = -1 * np.log10(np.array(p_values))
+def batch_ttest(values_1, values_2, equal_var=True):
+    # Two-sample t-test on every row of two (n_proteins x n_replicates) matrices at once.
+    # Same numbers as scipy.stats.ttest_ind per row: zero-variance rows give t = +/-inf (p = 0)
+    # if the means differ and t = nan (p = nan) if they are equal (e.g. all-zero rows).
+    a = np.asarray(values_1, dtype=float)
+    b = np.asarray(values_2, dtype=float)
+    n1 = a.shape[1]
+    n2 = b.shape[1]
+
+    mean_1 = np.mean(a, axis=1)
+    mean_2 = np.mean(b, axis=1)
+    # Sample variances computed the way scipy does (central moment scaled by n / (n - 1))
+    var_1 = np.mean((a - mean_1[:, None]) ** 2, axis=1) * (n1 / (n1 - 1.0))
+    var_2 = np.mean((b - mean_2[:, None]) ** 2, axis=1) * (n2 / (n2 - 1.0))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if equal_var:
+            # Student's t-test with pooled variance
+            dof = n1 + n2 - 2.0
+            pooled_var = ((n1 - 1) * var_1 + (n2 - 1) * var_2) / dof
+            denom = np.sqrt(pooled_var * (1.0 / n1 + 1.0 / n2))
+            dof = np.full_like(denom, dof)
+        else:
+            # Welch's t-test with Welch-Satterthwaite degrees of freedom
+            vn1 = var_1 / n1
+            vn2 = var_2 / n2
+            dof = (vn1 + vn2) ** 2 / (vn1 ** 2 / (n1 - 1) + vn2 ** 2 / (n2 - 1))
+            # scipy uses 1 degree of freedom if both variances are 0
+            dof = np.where(np.isnan(dof), 1, dof)
+            denom = np.sqrt(vn1 + vn2)
+
+        t_stat = (mean_1 - mean_2) / denom
+
+    # Two-sided p-value from the Student t distribution
+    p_values = 2 * special.stdtr(dof, -np.abs(t_stat))
+    return t_stat, p_values
+
+def calculate_pvalue(df1, df2, equal_var=True, permutation_test=None):
+    # All rows are tested at once, see batch_ttest (or permutation.PermutationTest if one is given)
+    if permutation_test is None:
+        t_stat, p_values = batch_ttest(df1, df2, equal_var=equal_var)
+    else:
+        t_stat, p_values = permutation_test.ttest(df1, df2)
+
+    transformed_pvals = -1 * np.log10(p_values)
     return transformed_pvals
 
-def normalization(file_1, file_2):    
+def comparison_conditions(file_1, file_2):
+    # Work out how two DATE_STRAIN_MEDIUM_PHASE files are compared.
+    # Returns the column suffixes and the output filename, or None if the files are not a valid comparison
+    # (different strains, or neither the same medium nor the same phase).
     filename_1 = os.path.basename(file_1)
     filename_2 = os.path.basename(file_2)
-    print(f"Normalizing values in files: {filename_1}, {filename_2}")
 
     # assign variables for the conditions
-    strain = filename_1.split('_')[1]
+    strain_1 = filename_1.split('_')[1]
+    strain_2 = filename_2.split('_')[1]
     medium_1 = filename_1.split('_')[2]
     medium_2 = filename_2.split('_')[2]
     phase_1 = filename_1.split('_')[3]
     phase_2 = filename_2.split('_')[3]
 
-    if medium_1 == medium_2: 
+    if strain_1 != strain_2:
+        return None
+
+    if medium_1 == medium_2 and phase_1 != phase_2:
         suf_1 = phase_1
         suf_2 = phase_2
-    elif phase_1 == phase_2:
+        output_filename = f'{strain_1}_{medium_1}_{phase_1}VS{phase_2}.txt'
+    elif phase_1 == phase_2 and medium_1 != medium_2:
         suf_1 = medium_1
         suf_2 = medium_2
+        output_filename = f'{strain_1}_{phase_1}_{medium_1}VS{medium_2}.txt'
+    else:
+        return None
+
+    return suf_1, suf_2, output_filename
+
+def read_sample(file, annotations=None):
+    # Read a formatted/annotated file (in any of the formats of table_io.py) into a pandas dataframe.
+    # If an AnnotationDictionary is given, the annotations are read as categories and stored as its codes.
+    if annotations is None:
+        df = read_table(file)
+    else:
+        dtypes = {column: 'category' for column in read_header(file) if column.startswith('Annotation')}
+        df = read_table(file, keep_categories=True, dtypes=dtypes)
+        for column in dtypes:
+            df[column] = annotations.encode(df[column])
+
+    # Convert the replicate columns to numeric, coercing any errors to NaN
+    replicates = replicate_columns(df.columns)
+    df[replicates] = df[replicates].apply(pd.to_numeric, errors='coerce')
+    return df
+
+class Sample:
+    # A parsed sample: the typed dataframe, the names of its replicate columns and their sums
+    def __init__(self, path, df):
+        self.path = path
+        self.df = df
+        self.replicates = replicate_columns(df.columns)
+        self.column_sums = df[self.replicates].sum().to_numpy()
+        # Encoded annotations only count with their codes, the texts are stored once in the AnnotationDictionary
+        self.nbytes = sum(df[column].array.codes.nbytes if isinstance(df[column].dtype, pd.CategoricalDtype)
+                          else int(df[column].memory_usage(index=False, deep=True)) for column in df.columns)
+
+class SampleStore:
+    # In-process cache of parsed samples, keyed by file path and modification time.
+    # When the samples take up more than max_bytes, the least recently used ones are dropped.
+    # The annotations of all samples are kept once in one AnnotationDictionary (see table_io.py).
+    def __init__(self, max_bytes=2 * 1024 ** 3):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.annotations = AnnotationDictionary()
+        self._samples = OrderedDict()
+
+    def __len__(self):
+        return len(self._samples)
+
+    def get(self, file):
+        path = os.path.abspath(file)
+        key = (path, os.stat(path).st_mtime_ns)
+
+        if key in self._samples:
+            self._samples.move_to_end(key)
+            return self._current(self._samples[key])
+
+        # Drop older versions of a file that changed on disk
+        for old_key in [old_key for old_key in self._samples if old_key[0] == path]:
+            self._remove(old_key)
+
+        sample = Sample(path, read_sample(path, self.annotations))
+        self._samples[key] = sample
+        self.nbytes += sample.nbytes
 
-    # Read files into pandas dataframes
-    df1 = pd.read_csv(file_1, sep='\t')
-    df2 = pd.read_csv(file_2, sep='\t')
+        # Evict the least recently used samples, but always keep the one just read
+        # (the annotations stay in the dictionary, they are needed again when a sample is read again)
+        dictionary_bytes = self.annotations.nbytes
+        while self.nbytes + dictionary_bytes > self.max_bytes and len(self._samples) > 1:
+            self._remove(next(iter(self._samples)))
 
-    # Convert the columns to numeric, coercing any errors to NaN
-    df1.iloc[:, 3:6] = df1.iloc[:, 3:6].apply(pd.to_numeric, errors='coerce')
-    df2.iloc[:, 3:6] = df2.iloc[:, 3:6].apply(pd.to_numeric, errors='coerce')
+        return self._current(sample)
 
-    # Calculate sums for the columns
-    SC1, SC2, SC3 = df1.iloc[:, 3:6].sum()
-    SC4, SC5, SC6 = df2.iloc[:, 3:6].sum()
+    def _current(self, sample):
+        # Reading a sample can add annotations to the dictionary. Samples read before keep their codes and only
+        # get the new categories when they are taken from the store again (once per change of the dictionary).
+        for column in sample.df.columns:
+            dtype = sample.df[column].dtype
+            # Codes are only added to the dictionary, so the number of categories tells whether they are current
+            if isinstance(dtype, pd.CategoricalDtype) and len(dtype.categories) != len(self.annotations):
+                sample.df[column] = self.annotations.update(sample.df[column])
+        return sample
 
-    # Calculate the average of the sums
-    sum_SC = SC1 + SC2 + SC3 + SC4 + SC5 + SC6
-    avg_SC = sum_SC / 6
+    def _remove(self, key):
+        self.nbytes -= self._samples.pop(key).nbytes
 
-    # Normalize the data
-    df1[f'norms_1_{suf_1}'] = (df1.iloc[:, 3] / SC1) * avg_SC
-    df1[f'norms_2_{suf_1}'] = (df1.iloc[:, 4] / SC2) * avg_SC
-    df1[f'norms_3_{suf_1}'] = (df1.iloc[:, 5] / SC3) * avg_SC
+# Store shared by all comparisons run in this process
+sample_store = SampleStore()
 
-    df2[f'norms_1_{suf_2}'] = (df2.iloc[:, 3] / SC4) * avg_SC
-    df2[f'norms_2_{suf_2}'] = (df2.iloc[:, 4] / SC5) * avg_SC
-    df2[f'norms_3_{suf_2}'] = (df2.iloc[:, 5] / SC6) * avg_SC
+def compare_samples(sample_1, sample_2, suf_1, suf_2, permutation_test=None):
+    # The normalized columns are added to copies, so the same sample can be used in several comparisons
+    df1 = sample_1.df.copy()
+    df2 = sample_2.df.copy()
+
+    # Average of the column sums of all replicates of both samples (the sums are computed once per sample)
+    avg_SC = np.concatenate([sample_1.column_sums, sample_2.column_sums]).mean()
+
+    # Normalize the data: every replicate column is scaled by avg_SC / its column sum
+    norms_1 = [f'norms_{replicate + 1}_{suf_1}' for replicate in range(len(sample_1.replicates))]
+    norms_2 = [f'norms_{replicate + 1}_{suf_2}' for replicate in range(len(sample_2.replicates))]
+    with step('normalize', rows=len(df1) + len(df2)):
+        df1[norms_1] = (df1[sample_1.replicates].to_numpy(dtype=float) / sample_1.column_sums) * avg_SC
+        df2[norms_2] = (df2[sample_2.replicates].to_numpy(dtype=float) / sample_2.column_sums) * avg_SC
 
     # Merge and format the dataframes
-    combined_df = merge_and_format(df1, df2, suf_1, suf_2)
+    with step('merge') as record:
+        combined_df = merge_and_format(df1, df2, suf_1, suf_2)
+        record['rows'] = len(combined_df)
 
     # Calculate row-wise averages and standard deviations for normalized columns
-    combined_df[f'Row_Average_{suf_1}'] = combined_df[[f'norms_1_{suf_1}', f'norms_2_{suf_1}', f'norms_3_{suf_1}']].mean(axis=1)
-    combined_df[f'STD_{suf_1}'] = combined_df[[f'norms_1_{suf_1}', f'norms_2_{suf_1}', f'norms_3_{suf_1}']].std(axis=1)
+    combined_df[f'Row_Average_{suf_1}'] = combined_df[norms_1].mean(axis=1)
+    combined_df[f'STD_{suf_1}'] = combined_df[norms_1].std(axis=1)
 
-    combined_df[f'Row_Average_{suf_2}'] = combined_df[[f'norms_1_{suf_2}', f'norms_2_{suf_2}', f'norms_3_{suf_2}']].mean(axis=1)
-    combined_df[f'STD_{suf_2}'] = combined_df[[f'norms_1_{suf_2}', f'norms_2_{suf_2}', f'norms_3_{suf_2}']].std(axis=1)
+    combined_df[f'Row_Average_{suf_2}'] = combined_df[norms_2].mean(axis=1)
+    combined_df[f'STD_{suf_2}'] = combined_df[norms_2].std(axis=1)
 
     # Add log2 fold change and p-values to your combined_df
     log2_df = calculate_log2(combined_df[f'Row_Average_{suf_1}'], combined_df[f'Row_Average_{suf_2}'])
-    pval_df = calculate_pvalue(combined_df[[f'norms_1_{suf_1}', f'norms_2_{suf_1}', f'norms_3_{suf_1}']],
-                           combined_df[[f'norms_1_{suf_2}', f'norms_2_{suf_2}', f'norms_3_{suf_2}']])
+    with step('ttest', rows=len(combined_df)):
+        pval_df = calculate_pvalue(combined_df[norms_1], combined_df[norms_2], permutation_test=permutation_test)
 
     combined_df['Log2_Fold_Change'] = log2_df
     combined_df['Transformed_P_Value'] = pval_df
 
-    # Get the directory of the input files
-    input_directory = os.path.dirname(file_1)
+    # q-values of the comparison (Benjamini-Hochberg and Storey)
+    for column, qvalues in qvalue_columns(pval_df).items():
+        combined_df[column] = qvalues
+
+    return combined_df
+
+def normalization(file_1, file_2, store=None, output_format='tsv', permutation_test=None, float_precision=None):
+    # Samples are taken from the store, so a file is only read once no matter in how many comparisons it is used.
+    # float_precision = significant digits of the numbers in text outputs (default: full precision, see table_io.py)
+    if store is None:
+        store = sample_store
+
+    filename_1 = os.path.basename(file_1)
+    filename_2 = os.path.basename(file_2)
+    print(f"Normalizing values in files: {filename_1}, {filename_2}")
+
+    conditions = comparison_conditions(file_1, file_2)
+    if conditions is None:
+        raise ValueError(f"{filename_1} and {filename_2} must share the strain and either the medium or the growth phase")
+    suf_1, suf_2, output_name = conditions
+
+    with step('normalization', file=output_name) as record:
+        # Read files into pandas dataframes (or take them from the store)
+        sample_1 = store.get(file_1)
+        sample_2 = store.get(file_2)
+
+        combined_df = compare_samples(sample_1, sample_2, suf_1, suf_2, permutation_test)
+        record['rows'] = len(combined_df)
+
+        # Create the output file path using the same directory as the input files
+        input_directory = os.path.dirname(file_1)
+        output_filename = os.path.join(input_directory, output_name)
 
-    # Create the output file path using the same directory
-    if medium_1 == medium_2: 
-        output_filename = os.path.join(input_directory, f'{strain}_{medium_1}_{phase_1}VS{phase_2}.txt')
-    elif phase_1 == phase_2: 
-        output_filename = os.path.join(input_directory, f'{strain}_{phase_1}_{medium_1}VS{medium_2}.txt')
-    
-    combined_df.to_csv(output_filename, sep='\t', index=False)
+        output_filename = write_table(combined_df, output_filename, output_format, float_precision)
 
     print(f"Log2 fold change and p-values added. Data written to: {output_filename}")
+    return output_filename
 
 if __name__ == "__main__": 
-    if len(sys.argv) != 3:
-        print("Usage: python statistics.py <input_filename_1> <input_filename_2>")
+    if len(sys.argv) not in (3, 4, 5):
+        print("Usage: python statistics.py <input_filename_1> <input_filename_2> [tsv|tsv.gz|tsv.zst|parquet|feather] [permutations]")
     else:
-        normalization(sys.argv[1], sys.argv[2])
+        output_format = sys.argv[3] if len(sys.argv) >= 4 else 'tsv'
+        permutation_test = None
+        if len(sys.argv) == 5:
+            permutation_test = PermutationTest(int(sys.argv[4]), workers=os.cpu_count())
+        normalization(sys.argv[1], sys.argv[2], output_format=output_format, permutation_test=permutation_test)
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+
+'''
+This script contains the functions to read and write the intermediate files of the pipeline (*_formatted, *_annotated and the comparison files from statistics.py).
+
+Besides the tab-delimited text files (.txt), the files can be stored in a binary columnar format, Parquet (.parquet) or Feather (.feather). These are faster to read and write and keep the column types, so the numbers do not have to be converted to text and back at every step. Both formats need the package pyarrow.
+The columns are stored with a fixed schema:
+    - Annotation columns: categorical
+    - Accession Number: text
+    - all other columns (counts, normalized values, statistics): floating point numbers
+
+read_table detects the format from the content of the file, so all scripts can read all formats. Text files are read with the pyarrow parser if pyarrow is installed (several times faster, and the numbers are read exactly as written).
+
+Scripts that only need a few columns (the plots and the lists of significant proteins) read only these columns with compact types (read_columns):
+    - Annotation columns: categorical (every annotation is stored once)
+    - Accession Number: text
+    - all other columns: 32-bit floating point numbers (float32; counts up to 16 million are exact), or 64-bit where the exact values matter
+For a comparison with 100,000 proteins the volcano plot then reads 3 of the 29 columns and needs about 1 MB instead of 45 MB.
+Annotations are long texts that are the same in many samples and comparisons. statistics.py, run_comparisons.py and campaign.py therefore keep them in an AnnotationDictionary: every annotation text is stored once per campaign and the rows only carry its integer code (as a pandas categorical). Missing annotations get the code of "Unknown" when a sample is read. The texts are only written out in the text files; the binary formats store the codes and the annotations used in the file.
+The tab-delimited text format stays the default and any file can be exported to it with this script.
+
+Text files can also be written compressed with gzip (tsv.gz, .txt.gz) or zstd (tsv.zst, .txt.zst; needs the package zstandard). Compressed files are recognised from their first bytes and read directly by all scripts. Text files are written in chunks of CHUNK_ROWS rows through a large buffer (or the compressor), so slow (e.g. network) storage gets a few large writes. By default the numbers are written at full precision; with float_precision they are rounded to this many significant digits, which makes the files smaller and faster to write.
+
+USAGE: python table_io.py </path/input_file> [</path/output_file.txt|.txt.gz|.txt.zst>]
+'''
+
+import glob
+import gzip
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+from instrumentation import step, timed
+
+try:
+    import pyarrow.ipc
+    import pyarrow.parquet
+    CSV_ENGINE = 'pyarrow'
+except ImportError:
+    CSV_ENGINE = 'c'
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Annotation of proteins without one; code 0 of every AnnotationDictionary
+UNKNOWN_ANNOTATION = 'Unknown'
+
+# File extension of each output format
+FORMATS = {
+    'tsv': '.txt',
+    'parquet': '.parquet',
+    'feather': '.feather',
+    'tsv.gz': '.txt.gz',
+    'tsv.zst': '.txt.zst',
+}
+
+# Formats in order of preference when the same file was written in several formats (the last one found is used):
+# text, compressed text, binary
+FORMAT_PREFERENCE = ['tsv', 'tsv.gz', 'tsv.zst', 'parquet', 'feather']
+
+# Compression of the compressed text formats
+COMPRESSIONS = {
+    'tsv.gz': 'gzip',
+    'tsv.zst': 'zstd',
+}
+
+# Compression levels: fast, the files are still 3 to 5 times smaller
+GZIP_LEVEL = 1
+ZSTD_LEVEL = 3
+
+# Rows of a text file formatted and written at once, and the buffer of written (uncompressed) text files
+CHUNK_ROWS = 20000
+WRITE_BUFFER = 1024 ** 2
+
+def table_format(path):
+    # Detect the format of a file from its first bytes
+    with open(path, 'rb') as file:
+        magic = file.read(6)
+
+    if magic[:4] == b'PAR1':
+        return 'parquet'
+    if magic == b'ARROW1':
+        return 'feather'
+    if magic[:2] == b'\x1f\x8b':
+        return 'tsv.gz'
+    if magic[:4] == b'\x28\xb5\x2f\xfd':
+        return 'tsv.zst'
+    return 'tsv'
+
+def is_text(fmt):
+    return fmt == 'tsv' or fmt in COMPRESSIONS
+
+def output_path(path, fmt):
+    # Replace the extension of path by the extension of the output format
+    stripped = strip_extension(path)
+    return (stripped if stripped != path else os.path.splitext(path)[0]) + FORMATS[fmt]
+
+def strip_extension(filename):
+    # Filename without the extension of any of the supported formats
+    for extension in FORMATS.values():
+        if filename.endswith(extension):
+            return filename[:-len(extension)]
+    return filename
+
+def find_comparisons(folder):
+    # Comparison files written by statistics.py (STRAIN_X_AVSB) in any of the formats,
+    # one file per comparison (see FORMAT_PREFERENCE if a comparison was written in several formats)
+    comparisons = {}
+    for fmt in FORMAT_PREFERENCE:
+        for filepath in sorted(glob.glob(os.path.join(folder, '*' + FORMATS[fmt]))):
+            name = strip_extension(os.path.basename(filepath))
+            if len(name.split('_')) == 3 and 'VS' in name.split('_')[2]:
+                comparisons[name] = filepath
+    return [comparisons[name] for name in sorted(comparisons)]
+
+def replicate_columns(columns):
+    # Replicate columns of a formatted/annotated sample (named 1, 2, ..., N)
+    return [column for column in columns if str(column).isdigit()]
+
+def comparison_columns(df):
+    # Names of the columns of a comparison file from statistics.py used by the later scripts
+    # (df is a dataframe or the list of column names, see read_header)
+    columns = list(getattr(df, 'columns', df))
+    averages = [column for column in columns if column.startswith('Row_Average_')]
+    deviations = [column for column in columns if column.startswith('STD_')]
+    return {
+        'annotation': next(column for column in columns if column.startswith('Annotation')),
+        'accession': 'Accession Number',
+        'average_1': averages[0],
+        'std_1': deviations[0],
+        'average_2': averages[1],
+        'std_2': deviations[1],
+        'log2_fold_change': 'Log2_Fold_Change',
+        'transformed_pvalue': 'Transformed_P_Value',
+    }
+
+class AnnotationDictionary:
+    # Interned annotations of a campaign: every text is stored once and has a fixed integer code.
+    # Codes are only added, so the codes of samples encoded earlier stay valid (see update).
+    def __init__(self):
+        self.dtype = pd.CategoricalDtype(pd.Index([UNKNOWN_ANNOTATION], dtype=object))
+
+    def __len__(self):
+        return len(self.dtype.categories)
+
+    @property
+    def nbytes(self):
+        return int(self.dtype.categories.memory_usage(deep=True))
+
+    def encode(self, annotations):
+        # Annotations as a categorical with the codes of the dictionary. Every distinct text is looked up once;
+        # missing annotations (and 0) get the code of Unknown.
+        annotations = pd.Series(annotations)
+        if isinstance(annotations.dtype, pd.CategoricalDtype):
+            codes, uniques = annotations.cat.codes.to_numpy(), pd.Index(annotations.cat.categories, dtype=object)
+        else:
+            codes, uniques = pd.factorize(annotations.astype(object))
+            uniques = pd.Index(uniques, dtype=object)
+
+        unique_codes = self.dtype.categories.get_indexer(uniques)
+        unknown = uniques.isin([0])
+        new = (unique_codes < 0) & ~unknown
+        if new.any():
+            start = len(self)
+            self.dtype = pd.CategoricalDtype(self.dtype.categories.append(uniques[new]))
+            unique_codes[new] = np.arange(start, len(self))
+        unique_codes[unknown] = 0
+
+        # Missing values (code -1) take the last entry, Unknown
+        unique_codes = np.append(unique_codes, 0).astype(np.int32)
+        return pd.Categorical.from_codes(unique_codes[codes], dtype=self.dtype)
+
+    def update(self, annotations):
+        # Annotations encoded earlier with the current categories of the dictionary, so the categories
+        # of before are not kept in memory (the codes stay the same)
+        annotations = pd.Categorical(annotations)
+        if annotations.dtype is self.dtype:
+            return annotations
+        return pd.Categorical.from_codes(annotations.codes, dtype=self.dtype)
+
+def apply_schema(df):
+    # Convert the columns to the types stored in the binary formats
+    # (only the annotations used in the file are stored with a categorical column)
+    for column in df.columns:
+        if column.startswith('Annotation'):
+            df[column] = df[column].astype('category').cat.remove_unused_categories()
+        elif column == 'Accession Number':
+            df[column] = df[column].astype(str)
+        else:
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype('float64')
+    return df
+
+def column_dtype(column, float_dtype='float32'):
+    # Compact type of a column of the pipeline files
+    if column.startswith('Annotation'):
+        return 'category'
+    if column == 'Accession Number':
+        return str
+    return float_dtype
+
+def open_text(path, mode='r', compression=None):
+    # Text file handle for reading or writing, (de)compressed with gzip or zstd if compression is given
+    if compression == 'gzip':
+        return gzip.open(path, mode + 't', compresslevel=GZIP_LEVEL, newline='')
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImportError("zstd compressed files need the package zstandard (pip install zstandard)")
+        return zstandard.open(path, mode + 't', cctx=zstandard.ZstdCompressor(level=ZSTD_LEVEL), newline='')
+    return open(path, mode, buffering=WRITE_BUFFER if 'w' in mode else -1, newline='')
+
+def read_header(path):
+    # Column names of a pipeline file in any of the supported formats, without reading the data
+    fmt = table_format(path)
+    if is_text(fmt):
+        with open_text(path, 'r', COMPRESSIONS.get(fmt)) as file:
+            return file.readline().rstrip('\r\n').split('\t')
+    if fmt == 'parquet':
+        names = pyarrow.parquet.read_schema(path).names
+    else:
+        with pyarrow.ipc.open_file(path) as reader:
+            names = reader.schema.names
+    return [name for name in names if not name.startswith('__index_level_')]
+
+@timed('read_table', rows=len, file=0)
+def read_table(path, keep_categories=False, columns=None, dtypes=None):
+    # Read a pipeline file in any of the supported formats into a pandas dataframe.
+    # columns = read only these columns, dtypes = types of the columns (see column_dtype).
+    # Categorical columns are turned back into text columns unless keep_categories is True,
+    # so the dataframe looks the same as one read from a text file.
+    fmt = table_format(path)
+
+    if is_text(fmt):
+        if fmt == 'tsv.zst' and zstandard is None:
+            raise ImportError("zstd compressed files need the package zstandard (pip install zstandard)")
+        return pd.read_csv(path, sep='\t', usecols=columns, dtype=dtypes, engine=CSV_ENGINE, compression=COMPRESSIONS.get(fmt))
+
+    if fmt == 'parquet':
+        df = pd.read_parquet(path, columns=columns)
+    else:
+        df = pd.read_feather(path, columns=columns)
+
+    if dtypes:
+        df = df.astype(dtypes)
+    if not keep_categories:
+        for column in df.columns:
+            if isinstance(df[column].dtype, pd.CategoricalDtype):
+                df[column] = df[column].astype(object)
+    return df
+
+def read_columns(path, columns, float_dtype='float32'):
+    # Read only the given columns of a pipeline file with compact types (see column_dtype).
+    # Columns that are not in the file are left out.
+    header = read_header(path)
+    columns = [column for column in dict.fromkeys(columns) if column in header]
+    return read_table(path, keep_categories=True, columns=columns,
+                      dtypes={column: column_dtype(column, float_dtype) for column in columns})
+
+def write_text(df, path, compression=None, float_precision=None):
+    # Write a dataframe as tab-delimited text in chunks of CHUNK_ROWS rows (numbers rounded to float_precision
+    # significant digits if given, otherwise at full precision)
+    float_format = None if float_precision is None else f'%.{float_precision}g'
+    with open_text(path, 'w', compression) as file:
+        df.to_csv(file, sep='\t', index=False, float_format=float_format, chunksize=CHUNK_ROWS)
+
+def write_table(df, path, fmt='tsv', float_precision=None):
+    # Write a dataframe in the given format. Returns the path written to (with the extension of the format).
+    # float_precision = significant digits of the numbers in text files (default: full precision)
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown output format: {fmt} (use one of {', '.join(FORMATS)})")
+
+    path = output_path(path, fmt)
+
+    with step('write_table', file=os.path.basename(path), rows=len(df)):
+        if is_text(fmt):
+            write_text(df, path, COMPRESSIONS.get(fmt), float_precision)
+        else:
+            df = apply_schema(df.copy())
+            if fmt == 'parquet':
+                df.to_parquet(path, index=False)
+            else:
+                df.reset_index(drop=True).to_feather(path)
+    return path
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python table_io.py </path/input_file> [</path/output_file.txt|.txt.gz|.txt.zst>]")
+        sys.exit(1)
+
+    inputfile = sys.argv[1]
+    outputfile = sys.argv[2] if len(sys.argv) == 3 else output_path(inputfile, 'tsv')
+    fmt = next((fmt for fmt in COMPRESSIONS if outputfile.endswith(FORMATS[fmt])), 'tsv')
+
+    output_filename = write_table(read_table(inputfile), outputfile, fmt)
+    print(f"Exported to: {output_filename}")
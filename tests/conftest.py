@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The scripts are imported as top-level modules from the repository folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,16 @@
+import numpy as np
+
+from permutation import PermutationTest
+from statistics import batch_ttest
+
+def test_constant_row_gives_nan_like_the_t_test():
+    values_1 = np.array([[7.3, 7.3, 7.3], [1.0, 2.0, 4.0], [5.0, 5.0, 5.0], [1000.1, 1000.2, 1000.4]])
+    values_2 = np.array([[7.3, 7.3, 7.3], [6.0, 8.0, 7.0], [3.0, 3.0, 3.0], [1000.3, 1000.6, 1000.5]])
+
+    t_stat, p_values = PermutationTest().ttest(values_1, values_2)
+    expected, _ = batch_ttest(values_1, values_2)
+
+    assert np.isnan(t_stat[0]) and np.isnan(p_values[0])
+    assert np.isinf(t_stat[2])
+    np.testing.assert_allclose(t_stat[[1, 3]], expected[[1, 3]], rtol=1e-9)
+    np.testing.assert_array_equal(np.isnan(t_stat), np.isnan(expected))
@@ -0,0 +1,26 @@
+import pandas as pd
+
+from statistics import merge_and_format
+
+def sample(accessions, replicates):
+    df = pd.DataFrame({'#': range(1, len(accessions) + 1), 'Annotation': ['protein ' + accession for accession in accessions],
+                       'Accession Number': accessions})
+    for replicate in range(1, replicates + 1):
+        df[str(replicate)] = [float(replicate)] * len(accessions)
+    df['Control'] = 0.0
+    return df
+
+def test_unequal_replicates_all_get_the_suffix():
+    expected = ['#EXP', 'AnnotationEXP', 'Accession Number', '1EXP', '2EXP', '3EXP', 'ControlEXP',
+                '#STAT', 'AnnotationSTAT', '1STAT', '2STAT', '3STAT', '4STAT', '5STAT', 'ControlSTAT']
+    df1 = sample(['P1', 'P2', 'P4'], 3)
+    df2 = sample(['P1', 'P3'], 5)
+
+    merged = merge_and_format(df1, df2, 'EXP', 'STAT')
+    assert list(merged.columns) == expected
+    assert list(merged['Accession Number']) == ['P1', 'P2', 'P3', 'P4']
+    assert list(merged['5STAT']) == [5.0, 0.0, 5.0, 0.0]
+
+    # Unsorted samples are merged with pd.merge and get the same columns
+    unsorted = merge_and_format(df1.iloc[::-1], df2.iloc[::-1], 'EXP', 'STAT')
+    assert sorted(unsorted.columns) == sorted(expected)
@@ -0,0 +1,30 @@
+import os
+
+import pandas as pd
+import pytest
+
+from table_io import FORMATS, find_comparisons, write_table
+
+pytest.importorskip('pyarrow')
+
+def comparison():
+    return pd.DataFrame({
+        'Annotation': ['kinase', 'Unknown'],
+        'Accession Number': ['P1', 'P2'],
+        'Log2_Fold_Change': [1.5, -0.25],
+        'Transformed_P_Value': [2.0, 0.1],
+    })
+
+def test_find_comparisons_one_file_per_comparison(tmp_path):
+    df = comparison()
+    for fmt in ('tsv', 'parquet', 'tsv.gz'):
+        write_table(df.copy(), str(tmp_path / ('SPO_LB_EXPVSSTAT' + FORMATS[fmt])), fmt)
+    write_table(df.copy(), str(tmp_path / 'SPO_EXP_LBVSMB.txt.gz'), 'tsv.gz')
+    write_table(df.copy(), str(tmp_path / 'SPO_EXP_LBVSMB.txt'), 'tsv')
+    # Samples and significant lists are not comparisons
+    write_table(df.copy(), str(tmp_path / '20240101_SPO_LB_EXP_annotated.txt'), 'tsv')
+    write_table(df.copy(), str(tmp_path / 'SPO_LB_EXPVSSTAT_significant.txt'), 'tsv')
+
+    found = [os.path.basename(filepath) for filepath in find_comparisons(str(tmp_path))]
+
+    assert found == ['SPO_EXP_LBVSMB.txt.gz', 'SPO_LB_EXPVSSTAT.parquet']
@@ -6,7 +6,7 @@ This script contains a FUNCTION TO PLOT TRANSFORMED p-values FROM A STUDENT T-TE
     2. annotate.py (Only if annotations were missing in the original file)
     3. statistics.py
 
-The input file needs to have 25 columns, where the extension '_1' is condition 1, and '_2' is condition 2: 
+The input file needs to have the following columns (here for 3 replicates; with N replicates there are N replicate and N norms columns per condition), where the extension '_1' is condition 1, and '_2' is condition 2. The columns are found by name: 
 #_1	Annotation_1	Accession Number	1_1	2_1	3_1	Control_1	norms_1_1	norms_2_1	norms_3_1	#_2	Annotation_2	1_2	2_2	3_2	Control_2	norms_1_2	norms_2_2	norms_3_2	Row_Average_1	STD_1	Row_Average_2	STD_2	Log2_Fold_Change	Transformed_P_Value
 
 
@@ -18,17 +18,35 @@ log2_fold_change = log2 fold change calculated from statistics.py function and s
 transformed_pvalues = p-value calculated from statistics.py function and saved in Transformed_P_Value dataframe
 annotations = annotations for the respective log2fold change and p-values. 
 output_path = filepath where output figures should be saved.
+categories = optional: category of every protein (see annotation_classes.py), shown when hovering over a point (volcano_plot_file takes a categories file, or 'default' for proteases and peptidases)
+fdr, qvalues = optional: if fdr (e.g. 0.05) and the q-values of the proteins are given, proteins with a q-value below fdr are coloured as significant instead of those with -log10(p-value) > 1.25, and the horizontal line is drawn at the p-value of the least significant of them (volcano_plot_file takes the q-values of the method bh, storey, campaign_bh or campaign_storey, see multiple_testing.py)
 
-USAGE: python xy_plot.py </path/input_filename.txt> </path/output_foldername/>
+USAGE: python volcano_plot.py </path/input_filename.txt> </path/output_foldername/> [</path/categories_file.txt>|default]
 '''
 
 import os
 import sys
-import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
-from plotly.offline import plot
 
-def volcano_plot(title, log2_fold_change, transformed_pvalues, annotations, output_path, x_axis_title="log2 fold change", y_axis_title="-log10 pvalue", point_radius=4):
+from figure_output import save_figure
+from annotation_classes import load_classifier
+from instrumentation import timed
+from multiple_testing import QVALUE_COLUMNS, comparison_qvalues
+from table_io import comparison_columns, read_columns, read_header, strip_extension
+
+def volcano_figure(title, log2_fold_change, transformed_pvalues, annotations, x_axis_title="log2 fold change", y_axis_title="-log10 pvalue", point_radius=4, fdr=None, qvalues=None, categories=None):
+    # Create the volcano plot (without saving it)
+
+    # Significant proteins: -log10(p-value) above 1.25, or a q-value below fdr
+    significance_line = 1.25
+    if fdr is None or qvalues is None:
+        significant = np.asarray(transformed_pvalues, dtype=float) > significance_line
+    else:
+        significant = np.asarray(qvalues, dtype=float) < fdr
+        # Line at the least significant protein that passes (none if no protein passes)
+        passed = np.asarray(transformed_pvalues, dtype=float)[significant]
+        significance_line = passed.min() if len(passed) else None
 
     fig = go.Figure()
     fig.update_layout(
@@ -73,11 +91,15 @@ def volcano_plot(title, log2_fold_change, transformed_pvalues, annotations, outp
             )
         ]
     )
+    if significance_line is None:
+        fig.layout.shapes = fig.layout.shapes[1:]
+    else:
+        fig.layout.shapes[0].update(y0=significance_line, y1=significance_line)
 
     colors = []
 
     for i in range(len(log2_fold_change)):
-        if transformed_pvalues[i] > 1.25:
+        if significant[i]:
             if log2_fold_change[i] > 1:
                 colors.append('#db3232')
             elif log2_fold_change[i] < -1:
@@ -87,44 +109,60 @@ def volcano_plot(title, log2_fold_change, transformed_pvalues, annotations, outp
         else:
             colors.append('rgba(150,150,150,0.5)')
 
+    # The points of the WebGL trace only need 32-bit floats (the significance above uses the exact values)
     fig.add_trace(
         go.Scattergl(
-            x=log2_fold_change,
-            y=transformed_pvalues,
+            x=np.asarray(log2_fold_change, dtype=np.float32),
+            y=np.asarray(transformed_pvalues, dtype=np.float32),
             mode='markers',
             text=annotations,
-            hovertemplate='%{text}: %{x}<br>',
+            customdata=categories,
+            hovertemplate='%{text}: %{x}<br>' if categories is None else '%{text}: %{x}<br>%{customdata}',
             marker={
                 'color': colors,
                 'size': point_radius,
             }
         )
     )
+    return fig
+
+def volcano_plot(title, log2_fold_change, transformed_pvalues, annotations, output_path, x_axis_title="log2 fold change", y_axis_title="-log10 pvalue", point_radius=4, auto_open=True, include_plotlyjs=True, fdr=None, qvalues=None, categories=None):
+    fig = volcano_figure(title, log2_fold_change, transformed_pvalues, annotations, x_axis_title, y_axis_title, point_radius, fdr, qvalues, categories)
+
+    # Save the plot as HTML and PDF file
+    save_figure(fig, output_path, f"volcano_{title}", auto_open=auto_open, include_plotlyjs=include_plotlyjs)
+
+    return fig
+
+@timed('volcano_plot', file=0)
+def volcano_plot_file(inputfile, output_folder, auto_open=True, include_plotlyjs=True, fdr=None, method='bh', categories=None):
+    # Create the volcano plot of a comparison file from statistics.py.
+    # Only the relevant columns are read (by name, so files with any number of replicates work), the numbers as
+    # 64-bit floats so the thresholds give the same proteins as significant_list.py.
+    columns = comparison_columns(read_header(inputfile))
+    needed = [columns['annotation'], columns['log2_fold_change'], columns['transformed_pvalue']]
+    if fdr is not None:
+        needed.append(QVALUE_COLUMNS.get(method, method))
+    df = read_columns(inputfile, needed, float_dtype='float64')
+
+    log2_fold_change = df[columns['log2_fold_change']]
+    transformed_pvalues = df[columns['transformed_pvalue']]
+    annotations = df[columns['annotation']]
+    qvalues = comparison_qvalues(df, method) if fdr is not None else None
+    if categories is not None:
+        categories = np.asarray(load_classifier(categories).classify(annotations), dtype=object)
+
+    title = strip_extension(os.path.basename(inputfile))
     
-    # Save the plot as an HTML file
-    output_html = os.path.join(output_path, f"volcano_{title}.html")
-    plot(fig, filename=output_html)
-
-    # Save the plot as a PDF file
-    output_pdf = os.path.join(output_path, f"volcano_{title}.pdf")
-    fig.write_image(output_pdf)
+    return volcano_plot(title, log2_fold_change=log2_fold_change, transformed_pvalues=transformed_pvalues, annotations=annotations, output_path=output_folder, auto_open=auto_open, include_plotlyjs=include_plotlyjs, fdr=fdr, qvalues=qvalues, categories=categories)
 
 if __name__ == "__main__": 
-    if len(sys.argv) != 3:  # Check if there are exactly 2 arguments
-        print("Usage: python volcano_plot.py </path/input_filename.txt> </path/output_foldername/>")
+    if len(sys.argv) not in (3, 4):  # Check if there are 2 or 3 arguments
+        print("Usage: python volcano_plot.py </path/input_filename.txt> </path/output_foldername/> [</path/categories_file.txt>|default]")
         sys.exit(1)
     
     inputfile = sys.argv[1]
     output_folder = sys.argv[2]
+    categories = sys.argv[3] if len(sys.argv) == 4 else None
 
-    # Load the input file into a DataFrame
-    df = pd.read_csv(inputfile, sep='\t')
-
-    # Extract the relevant columns
-    log2_fold_change = df.iloc[:, 23]
-    transformed_pvalues = df.iloc[:, 24]
-    annotations = df.iloc[:, 1] 
-
-    title = os.path.basename(inputfile).replace(".txt", "")
-    
-    volcano_plot(title, log2_fold_change=log2_fold_change, transformed_pvalues=transformed_pvalues, annotations=annotations, output_path=output_folder)
+    volcano_plot_file(inputfile, output_folder, categories=categories)
@@ -6,7 +6,7 @@ This script contains a FUNCTION TO PLOT AVERAGED AND NORMALIZED SPECTRAL COUNTS
     2. annotate.py (Only if annotations were missing in the original file)
     3. statistics.py
 
-The input file needs to have 25 columns, where the extension '_1' is condition 1, and '_2' is condition 2: 
+The input file needs to have the following columns (here for 3 replicates; with N replicates there are N replicate and N norms columns per condition), where the extension '_1' is condition 1, and '_2' is condition 2. The columns are found by name: 
 #_1	Annotation_1	Accession Number	1_1	2_1	3_1	Control_1	norms_1_1	norms_2_1	norms_3_1	#_2	Annotation_2	1_2	2_2	3_2	Control_2	norms_1_2	norms_2_2	norms_3_2	Row_Average_1	STD_1	Row_Average_2	STD_2	Log2_Fold_Change	Transformed_P_Value
 
 df1: dataframe containing normalized spectral counts of condition 1
@@ -18,25 +18,79 @@ title = Title of the plot
 filename = filename of .html/.pdf file generated
 width = width of plot
 height = height of plot
+dense = dense mode for large datasets: the points are drawn with WebGL and the non-protease background is thinned to one point per cell of a 300 x 300 grid (points in sparse regions, e.g. outliers, are all kept). The proteases and peptidases are always shown completely, with hover text. auto (default) = dense mode above 5000 proteins, dense = always, full = never
+error_bars = draw the standard deviations as error bars (default: only if not in dense mode)
+categories = file with the highlighted categories and their keywords (see annotation_classes.py); by default proteases, peptidases, metalloproteases and metallopeptidases are highlighted. Every protein is drawn in one category only.
 
 
-USAGE: python xy_plot.py </path/input_filename.txt> </path/output_foldername/>
+USAGE: python xy_plot.py </path/input_filename.txt> </path/output_foldername/> [auto|dense|full] [</path/categories_file.txt>]
 '''
 
 import os
 import sys
-import pandas as pd
 import numpy as np
 from scipy import stats
+import plotly.colors
 import plotly.graph_objects as go
-from plotly.offline import plot
-
-def plot_and_regression(df1, df2, df3, df4, df5, title, output_path, width=1000, height=1000):
-    x = df1.values
-    y = df2.values
-    z = df3.values
-    yerr = df4.values
-    xerr = df5.values
+
+from annotation_classes import load_classifier
+
+from figure_output import save_figure
+from instrumentation import timed
+from table_io import comparison_columns, read_columns, read_header, strip_extension
+
+# Colours of the categories (see annotation_classes.py); other categories get the colours of COLOR_CYCLE
+COLORS = {
+    'Non-Protease': 'black',
+    'Other': 'black',
+    'Protease': 'blue',
+    'Peptidase': 'red',
+    'Metallopeptidase': 'pink',
+    'Metalloprotease': 'lightblue',
+}
+COLOR_CYCLE = plotly.colors.qualitative.Plotly
+
+# Above this many proteins the dense mode is used (dense=None)
+DENSE_ROWS = 5000
+
+# Values of dense for the modes of the command line
+DENSE_MODES = {'auto': None, 'dense': True, 'full': False}
+
+# Grid of the dense mode: the background proteins are thinned to one per cell of a GRID_SIZE x GRID_SIZE grid
+GRID_SIZE = 300
+
+def thin_points(x, y, grid_size=GRID_SIZE):
+    # Indices of the points to draw: one point per cell of a grid over the plot, so dense regions (where the
+    # points overlap anyway) are thinned and points in sparse regions (e.g. outliers) are all kept
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if len(x) == 0:
+        return np.arange(0)
+
+    cells = []
+    for values in (x, y):
+        low = np.nanmin(values)
+        span = np.nanmax(values) - low
+        cell = np.zeros(len(values), dtype=np.int64) if not span > 0 else ((values - low) / span * (grid_size - 1)).astype(np.int64)
+        cells.append(cell)
+    _, first = np.unique(cells[0] * grid_size + cells[1], return_index=True)
+    return np.sort(first)
+
+def xy_figure(df1, df2, df3, df4, df5, title, width=1000, height=1000, dense=None, error_bars=None, classifier=None):
+    # Create the xy plot with the linear regression, returns the figure and the regression results.
+    # classifier = annotation_classes.AnnotationClassifier of the highlighted categories (default: proteases and peptidases).
+    # dense = draw with WebGL and thin the non-protease background (see thin_points); None: only above DENSE_ROWS proteins.
+    # error_bars = draw the standard deviations as error bars; None: only if not dense.
+    x = np.asarray(df1, dtype=float)
+    y = np.asarray(df2, dtype=float)
+    z = np.asarray(df3, dtype=object)
+    yerr = np.asarray(df4, dtype=float)
+    xerr = np.asarray(df5, dtype=float)
+    if dense is None:
+        dense = len(x) > DENSE_ROWS
+    if error_bars is None:
+        error_bars = not dense
+    Scatter = go.Scattergl if dense else go.Scatter
     
     # Perform linear regression
     slope, intercept, r_value, p_value, std_err = stats.linregress(x, y)
@@ -47,118 +101,97 @@ def plot_and_regression(df1, df2, df3, df4, df5, title, output_path, width=1000,
     # Calculate R squared
     r_squared = r_value ** 2
 
-    # Filter data points based on annotation
-    protease_indices = df1.index[df3.str.contains('protease', case=False)]
-    peptidase_indices = df1.index[df3.str.contains('peptidase', case=False)]
-    metalloprotease_indices = df1.index[df3.str.contains('metalloprotease', case=False)]
-    metallopeptidase_indices = df1.index[df3.str.contains('metallopeptidase', case=False)]
-    non_protease_indices = df1.index[~df3.str.contains('protease|peptidase|metalloprotease|metallopeptidase', case=False)]
+    # Every protein is in exactly one category, the unclassified ones are the background
+    classifier = classifier or load_classifier()
+    codes = classifier.classify(df3).codes
+    other = len(classifier.categories)
+    other_indices = np.flatnonzero(codes == other)
+    name = classifier.other
+    if dense:
+        shown = other_indices[thin_points(x[other_indices], y[other_indices])]
+        if len(shown) < len(other_indices):
+            name = f'{classifier.other} ({len(shown)} of {len(other_indices)} shown)'
+        other_indices = shown
+
+    def trace(indices, name, color):
+        # Scatter trace of the proteins at indices, with the annotations as hover text
+        errors = {}
+        if error_bars:
+            errors = dict(error_y=dict(type='data', array=yerr[indices]), error_x=dict(type='data', array=xerr[indices]))
+        return Scatter(
+            x=x[indices],
+            y=y[indices],
+            mode='markers',
+            name=name,
+            text=z[indices],
+            marker=dict(color=color),
+            **errors
+        )
 
     # Create traces for each category
-    trace_non_protease = go.Scatter(
-        x=x[non_protease_indices],
-        y=y[non_protease_indices],
-        error_y=dict(type='data', array=yerr[non_protease_indices]),
-        error_x=dict(type='data', array=xerr[non_protease_indices]),
-        mode='markers',
-        name='Non-Protease',
-        text=z[non_protease_indices],
-        marker=dict(color='black')
-    )
-
-    trace_protease = go.Scatter(
-        x=x[protease_indices],
-        y=y[protease_indices],
-        error_y=dict(type='data', array=yerr[protease_indices]),
-        error_x=dict(type='data', array=xerr[protease_indices]),
-        mode='markers',
-        name='Protease',
-        text=z[protease_indices],
-        marker=dict(color='blue')
-    )
-
-    trace_peptidase = go.Scatter(
-        x=x[peptidase_indices],
-        y=y[peptidase_indices],
-        error_y=dict(type='data', array=yerr[peptidase_indices]),
-        error_x=dict(type='data', array=xerr[peptidase_indices]),
-        mode='markers',
-        name='Peptidase',
-        text=z[peptidase_indices],
-        marker=dict(color='red')
-    )
-
-    trace_metallopeptidase = go.Scatter(
-        x=x[metallopeptidase_indices],
-        y=y[metallopeptidase_indices],
-        error_y=dict(type='data', array=yerr[metallopeptidase_indices]),
-        error_x=dict(type='data', array=xerr[metallopeptidase_indices]),
-        mode='markers',
-        name='Metallopeptidase',
-        text=z[metallopeptidase_indices],
-        marker=dict(color='pink')
-    )
-
-    trace_metalloprotease = go.Scatter(
-        x=x[metalloprotease_indices],
-        y=y[metalloprotease_indices],
-        error_y=dict(type='data', array=yerr[metalloprotease_indices]),
-        error_x=dict(type='data', array=xerr[metalloprotease_indices]),
-        mode='markers',
-        name='Metalloprotease',
-        text=z[metalloprotease_indices],
-        marker=dict(color='lightblue')
-    )
-
-    # Linear regression line
-    trace_regression = go.Scatter(
-        x=x,
-        y=predicted_values,
+    data = [trace(other_indices, name, COLORS.get(classifier.other, 'black'))]
+    for code, category in enumerate(classifier.categories):
+        data.append(trace(np.flatnonzero(codes == code), category, COLORS.get(category, COLOR_CYCLE[code % len(COLOR_CYCLE)])))
+
+    # Linear regression line (a straight line only needs its end points)
+    line_x = np.array([np.nanmin(x), np.nanmax(x)]) if dense and len(x) else x
+    trace_regression = Scatter(
+        x=line_x,
+        y=slope * line_x + intercept if dense else predicted_values,
         mode='lines',
         name='Linear Regression',
         line=dict(color='red')
     )
-
-    data = [trace_non_protease, trace_protease, trace_peptidase, trace_metallopeptidase, trace_metalloprotease, trace_regression]
+    data.append(trace_regression)
 
     layout = go.Layout(
         title=f'{title} (R² = {r_squared:.2f})',
-        xaxis=dict(title=df1.name),
-        yaxis=dict(title=df2.name),
+        xaxis=dict(title=getattr(df1, 'name', None)),
+        yaxis=dict(title=getattr(df2, 'name', None)),
         showlegend=True,
         width=width,
         height=height
     )
     fig = go.Figure(data=data, layout=layout)
 
-    # Save the plot as an HTML file
-    output_html = os.path.join(output_path, f"{title}.html")
-    plot(fig, filename=output_html)
+    return fig, slope, intercept, std_err
+
+def plot_and_regression(df1, df2, df3, df4, df5, title, output_path, width=1000, height=1000, auto_open=True, include_plotlyjs=True,
+                        dense=None, error_bars=None, classifier=None):
+    fig, slope, intercept, std_err = xy_figure(df1, df2, df3, df4, df5, title, width, height, dense, error_bars, classifier)
 
-    # Save the plot as a PDF file
-    output_pdf = os.path.join(output_path, f"{title}.pdf")
-    fig.write_image(output_pdf)
+    # Save the plot as HTML and PDF file
+    save_figure(fig, output_path, title, auto_open=auto_open, include_plotlyjs=include_plotlyjs)
 
     return slope, intercept, std_err, df1, df2, df3
 
+@timed('xy_plot', file=0)
+def xy_plot_file(inputfile, output_folder, auto_open=True, include_plotlyjs=True, dense=None, error_bars=None, categories=None):
+    # Create the xy plot of a comparison file from statistics.py.
+    # Only the relevant columns are read (by name, so files with any number of replicates work).
+    columns = comparison_columns(read_header(inputfile))
+    df = read_columns(inputfile, [columns[name] for name in ('average_1', 'average_2', 'annotation', 'std_1', 'std_2')])
+
+    df1 = df[columns['average_1']]
+    df2 = df[columns['average_2']]
+    df3 = df[columns['annotation']]
+    df4 = df[columns['std_1']]
+    df5 = df[columns['std_2']]
+
+    title = strip_extension(os.path.basename(inputfile))
+    
+    fig = xy_figure(df1, df2, df3, df4, df5, title, dense=dense, error_bars=error_bars, classifier=load_classifier(categories))[0]
+    save_figure(fig, output_folder, title, auto_open=auto_open, include_plotlyjs=include_plotlyjs)
+    return fig
+
 if __name__ == "__main__": 
-    if len(sys.argv) != 3:  # Check if there are exactly 2 arguments
-        print("Usage: python xy_plot.py </path/input_filename.txt> </path/output_foldername/>")
+    if len(sys.argv) not in (3, 4, 5):  # Check if there are 2 to 4 arguments
+        print("Usage: python xy_plot.py </path/input_filename.txt> </path/output_foldername/> [auto|dense|full] [</path/categories_file.txt>]")
         sys.exit(1)
     
     inputfile = sys.argv[1]
     output_folder = sys.argv[2]
+    dense = DENSE_MODES[sys.argv[3]] if len(sys.argv) >= 4 else None
+    categories = sys.argv[4] if len(sys.argv) == 5 else None
 
-    # Load the input file into a DataFrame
-    df = pd.read_csv(inputfile, sep='\t')
-
-    # Extract the relevant columns
-    df1 = df.iloc[:, 19]
-    df2 = df.iloc[:, 21]
-    df3 = df.iloc[:, 1] 
-    df4 = df.iloc[:, 20]
-    df5 = df.iloc[:, 22]
-
-    title = os.path.basename(inputfile).replace(".txt", "")
-    
-    plot_and_regression(df1, df2, df3, df4, df5, title, output_folder)
+    xy_plot_file(inputfile, output_folder, dense=dense, categories=categories)